@@ -208,6 +208,8 @@ class PrivateKey:
 class S256Point(Point):
     def __init__(self, x, y, a=None, b=None):
         a, b = S256Field(A), S256Field(B)
+        # sec, hash160 and address results, filled in on first use
+        self._encodings = None
         if type(x) == int:
             super().__init__(a=a, b=b, x=S256Field(x), y=S256Field(y))
         else:
@@ -228,14 +230,23 @@ class S256Point(Point):
         total = u * G + v * self
         return total.x.num == sig.r
 
+    def _memo(self, key):
+        if self._encodings is None:
+            self._encodings = {}
+        return self._encodings.get(key)
+
     def sec(self, compressed=True):
-        if not compressed:
-            return b'\x04' + self.x.num.to_bytes(32, 'big') + self.y.num.to_bytes(32, 'big')
-        if compressed:
-            if self.y.num % 2 == 0:
-                return b'\x02' + self.x.num.to_bytes(32, 'big')
+        key = ('sec', compressed)
+        result = self._memo(key)
+        if result is None:
+            if not compressed:
+                result = b'\x04' + self.x.num.to_bytes(32, 'big') + self.y.num.to_bytes(32, 'big')
+            elif self.y.num % 2 == 0:
+                result = b'\x02' + self.x.num.to_bytes(32, 'big')
             else:
-                return b'\x03' + self.x.num.to_bytes(32, 'big')
+                result = b'\x03' + self.x.num.to_bytes(32, 'big')
+            self._encodings[key] = result
+        return result
 
     @classmethod
     def parse(cls, sec_bin):
@@ -260,18 +271,24 @@ class S256Point(Point):
         else:
             return S256Point(x, odd_beta)
 
+    def hash160(self, compressed=True):
+        key = ('hash160', compressed)
+        result = self._memo(key)
+        if result is None:
+            result = self._encodings[key] = hash160(self.sec(compressed))
+        return result
 
-def hash160(self, compressed=True):
-    return hash160(self.sec(compressed))
-
-
-def address(self, compressed=True, testnet=False):
-    h160 = self.hash160(compressed)
-    if testnet:
-        prefix = b'\x6f'
-    else:
-        prefix = b'\x00'
-    return encode_base58_checksum(prefix + h160)
+    def address(self, compressed=True, testnet=False):
+        key = ('address', compressed, testnet)
+        result = self._memo(key)
+        if result is None:
+            h160 = self.hash160(compressed)
+            if testnet:
+                prefix = b'\x6f'
+            else:
+                prefix = b'\x00'
+            result = self._encodings[key] = encode_base58_checksum(prefix + h160)
+        return result
 
 
 G = S256Point(
@@ -0,0 +1,323 @@
+'''
+Micro benchmarks for the secp256k1 code paths, run with
+
+    python bench.py
+'''
+from multiprocessing import cpu_count
+from random import randint
+from time import perf_counter
+
+from ecc import (
+    G, N, Point, PrivateKey, S256Point, Signature,
+    g_mul, g_table, jacobian_add, jacobian_double, jacobian_mul, multi_scalar_mul, sec_many,
+    strauss_mul,
+)
+from helper import (
+    BASE58_ALPHABET, BECH32_GENERATOR, address_to_script_pubkey_many, bech32_polymod,
+    decode_base58_many, encode_base58_many, encode_segwit_address,
+)
+from keyrange import scan_range
+from schnorr import schnorr_sign, schnorr_verify, schnorr_verify_batch, xonly_pubkey
+
+
+def timeit(fn, repeat):
+    start = perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (perf_counter() - start) / repeat
+
+
+def report(name, baseline, current):
+    print('{:<32} {:>10.3f} ms {:>10.3f} ms {:>8.1f}x'.format(
+        name, baseline * 1000, current * 1000, baseline / current))
+
+
+def affine_verify(point, z, sig):
+    '''S256Point.verify as it is written with the affine Point.__rmul__'''
+    s_inv = pow(sig.s, N - 2, N)
+    u = z * s_inv % N
+    v = sig.r * s_inv % N
+    total = Point.__rmul__(G, u) + Point.__rmul__(point, v)
+    return total.x.num == sig.r
+
+
+def prepend_encode_base58(s):
+    '''encode_base58 as it was written, one digit prepended per divmod'''
+    count = len(s) - len(s.lstrip(b'\x00'))
+    num = int.from_bytes(s, 'big')
+    result = ''
+    while num > 0:
+        num, mod = divmod(num, 58)
+        result = BASE58_ALPHABET[mod] + result
+    return '1' * count + result
+
+
+def index_decode_base58(s):
+    num = 0
+    for c in s:
+        num = num * 58 + BASE58_ALPHABET.index(c)
+    return num
+
+
+def reference_polymod(values):
+    '''the BIP173 reference checksum loop'''
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= BECH32_GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def bench_private_key(repeat=20):
+    secret = 0x1f2e3d4c5b6a79881f2e3d4c5b6a79881f2e3d4c5b6a79881f2e3d4c5b6a7988
+    baseline = timeit(lambda i: Point.__rmul__(G, secret + i), repeat)
+    # the point is computed lazily, so time the access that computes it
+    current = timeit(lambda i: PrivateKey(secret + i).point, repeat)
+    report('PrivateKey(secret).point', baseline, current)
+
+
+def bench_sign(repeat=20):
+    private_key = PrivateKey(0x0ddba11c0ffee0ddba11c0ffee0ddba11c0ffee)
+    z = 0x6c9b3ed3d3b2d79a0f0e5e0a8d3d56c3a2b0a5fa5ca8ec9f9d0a1b3e0b4c5d6e
+
+    def affine_sign(i):
+        k = (z + i) % N
+        r = Point.__rmul__(G, k).x.num
+        return Signature(r, (z + r * private_key.secret) * pow(k, N - 2, N) % N)
+
+    baseline = timeit(affine_sign, repeat)
+    current = timeit(lambda i: private_key.sign(z), repeat)
+    report('PrivateKey.sign', baseline, current)
+
+
+def bench_verify(repeat=20):
+    private_key = PrivateKey(0x8badf00d8badf00d8badf00d8badf00d8badf00d8badf00d8badf00d)
+    point = private_key.point
+    z = 0x231c6f3d980a6b0fb7152f85cee7eb52bf92433d9919b9c5218cb08e79cce78
+    sig = private_key.sign(z)
+    baseline = timeit(lambda i: affine_verify(point, z, sig), repeat)
+    current = timeit(lambda i: point.verify(z, sig), repeat)
+    report('S256Point.verify', baseline, current)
+
+
+def bench_joint_mul(repeat=50):
+    point = 0x5eed * G
+    u = 0x9c0bbf0bde6b2d9e0c1ae6b5a9b8b4f27e2a3d8b2c3f1e0d9c8b7a6f5e4d3c2b
+    v = 0x1d2c3b4a59687766554433221100ffeeddccbbaa99887766554433221100ffee
+    baseline = timeit(lambda i: jacobian_add(
+        g_mul(u + i), jacobian_mul(point.x.num, point.y.num, v + i)), repeat)
+    points = ((G.x.num, G.y.num), (point.x.num, point.y.num))
+    current = timeit(lambda i: strauss_mul((u + i, v + i), points), repeat)
+    report('u*G + v*P two pass vs joint', baseline, current)
+
+
+def bench_glv(repeat=50):
+    point = 0xc0ffee * G
+    k = 0xe3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855
+    private_key = PrivateKey(0xc0ffee)
+    z = 0x4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b
+    sig = private_key.sign(z)
+    jacobian = timeit(lambda i: (k + i) * point, repeat)
+    jacobian_verify = timeit(lambda i: point.verify(z, sig), repeat)
+    S256Point.set_engine('glv')
+    try:
+        glv = timeit(lambda i: (k + i) * point, repeat)
+        glv_verify = timeit(lambda i: point.verify(z, sig), repeat)
+    finally:
+        S256Point.set_engine('jacobian')
+    report('k * P jacobian vs glv', jacobian, glv)
+    report('verify jacobian vs glv', jacobian_verify, glv_verify)
+
+
+def bench_verify_batch(count=512):
+    items = []
+    for i in range(1, count + 1):
+        private_key = PrivateKey(0xba7c4 * i)
+        items.append((private_key.point, i, private_key.sign(i)))
+    start = perf_counter()
+    for point, z, sig in items:
+        point.verify(z, sig)
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    S256Point.verify_batch(items)
+    current = (perf_counter() - start) / count
+    report('verify_batch per sig ({} cpus)'.format(cpu_count()), baseline, current)
+
+
+def bench_sec_many(count=2000):
+    points = [jacobian_double(g_mul(0x5ec * i)) for i in range(1, count + 1)]
+    start = perf_counter()
+    for p in points:
+        S256Point.from_jacobian(p).sec()
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    sec_many(points)
+    current = (perf_counter() - start) / count
+    report('sec per key vs sec_many', baseline, current)
+
+
+def bench_pinned_verify(repeat=50):
+    private_key = PrivateKey(0xf00d)
+    point = private_key.point
+    z = 0x2b4ee5d1c9a7f3e8b6d4c2a0f8e6d4c2b0a8f6e4d2c0b8a6f4e2d0c8b6a4f2e0
+    sig = private_key.sign(z)
+    baseline = timeit(lambda i: point.verify(z, sig), repeat)
+    point.pin()
+    current = timeit(lambda i: point.verify(z, sig), repeat)
+    report('verify unpinned vs pinned', baseline, current)
+
+
+def bench_sign_many(count=500):
+    private_key = PrivateKey(0x9a7011)
+    zs = [0x51c0de * i for i in range(1, count + 1)]
+    start = perf_counter()
+    for z in zs:
+        private_key.sign(z)
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    private_key.sign_many(zs)
+    current = (perf_counter() - start) / count
+    report('sign per sig vs sign_many', baseline, current)
+
+
+def bench_rfc6979(repeat=500):
+    private_key = PrivateKey(0x6979)
+    z = 0x8f434346648f6b96df89dda901c5176b10a6d83961dd3c1ac88b59b2dc327aa4
+
+    def random_nonce_sign(i):
+        k = randint(1, N - 1)
+        r = S256Point.from_jacobian(g_mul(k)).x.num
+        s = (z + r * private_key.secret) * pow(k, -1, N) % N
+        return Signature(r, s if s <= N // 2 else N - s)
+
+    def uncached_k(i):
+        private_key._nonce_hmac = None
+        return private_key.deterministic_k(z + i)
+
+    baseline = timeit(random_nonce_sign, repeat)
+    current = timeit(lambda i: private_key.sign(z + i), repeat)
+    report('sign random vs rfc6979 nonce', baseline, current)
+    baseline = timeit(uncached_k, repeat)
+    current = timeit(lambda i: private_key.deterministic_k(z + i), repeat)
+    report('rfc6979 k uncached vs cached', baseline, current)
+
+
+def bench_scan_range(count=2000):
+    start_secret = 10 ** 20
+    start = perf_counter()
+    for i in range(count):
+        PrivateKey(start_secret + i).point.address()
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    for _ in scan_range(start_secret, count):
+        pass
+    current = (perf_counter() - start) / count
+    report('address per key vs scan_range', baseline, current)
+
+
+def bench_recover(repeat=50):
+    private_key = PrivateKey(0x2ec0)
+    z = 0x3b6a27bcceb6a42d62a3a8d02a6f0d73653215771de243a63ac048a18b59da29
+    sig, recid = private_key.sign_recoverable(z)
+    baseline = timeit(lambda i: private_key.point.verify(z, sig), repeat)
+    current = timeit(lambda i: sig.recover(z, recid), repeat)
+    report('verify vs recover', baseline, current)
+
+
+def bench_multi_scalar_mul(sizes=(2, 16, 256, 4096)):
+    for n in sizes:
+        points = list(batch_points(n))
+        scalars = [(0x9e3779b97f4a7c15f39cc0605cedc834 * (i + 1)) ** 2 % N for i in range(n)]
+        start = perf_counter()
+        total = S256Point(None, None)
+        for scalar, point in zip(scalars, points):
+            total += scalar * point
+        baseline = perf_counter() - start
+        start = perf_counter()
+        multi_scalar_mul(scalars, points)
+        current = perf_counter() - start
+        report('multi_scalar_mul n={}'.format(n), baseline, current)
+
+
+def bench_schnorr_batch(count=256):
+    items = []
+    for i in range(1, count + 1):
+        msg = i.to_bytes(32, 'big')
+        items.append((xonly_pubkey(0x5c40 * i), msg, schnorr_sign(0x5c40 * i, msg)))
+    start = perf_counter()
+    for item in items:
+        schnorr_verify(*item)
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    schnorr_verify_batch(items)
+    current = (perf_counter() - start) / count
+    report('schnorr verify vs batch n={}'.format(count), baseline, current)
+
+
+def bench_base58(count=20000, size=25):
+    payloads = [bytes([i % 256]) + (i * 0x9e3779b97f4a7c15).to_bytes(size - 1, 'big') for i in range(count)]
+    strings = encode_base58_many(payloads, checksum=False)
+    for name, baseline_fn, current_fn, items in (
+            ('base58 encode', prepend_encode_base58, lambda items: encode_base58_many(items, False), payloads),
+            ('base58 decode', index_decode_base58, lambda items: decode_base58_many(items, False), strings)):
+        start = perf_counter()
+        for item in items:
+            baseline_fn(item)
+        baseline = (perf_counter() - start) / count
+        start = perf_counter()
+        current_fn(items)
+        current = (perf_counter() - start) / count
+        report('{} {} bytes'.format(name, size), baseline, current)
+
+
+def bench_bech32(count=20000):
+    programs = [(i * 0x9e3779b97f4a7c15).to_bytes(20, 'big') for i in range(count)]
+    addresses = [encode_segwit_address(0, program) for program in programs]
+    values = [[ord(c) & 31 for c in address] for address in addresses]
+    start = perf_counter()
+    for v in values:
+        reference_polymod(v)
+    baseline = (perf_counter() - start) / count
+    start = perf_counter()
+    for v in values:
+        bech32_polymod(v)
+    current = (perf_counter() - start) / count
+    report('bech32 polymod', baseline, current)
+    start = perf_counter()
+    address_to_script_pubkey_many(addresses)
+    elapsed = (perf_counter() - start) / count
+    print('address_to_script_pubkey_many {:>13.3f} ms per address'.format(elapsed * 1000))
+
+
+def batch_points(n):
+    step = 0x100000001 * G
+    point = step
+    for _ in range(n):
+        yield point
+        point += step
+
+
+if __name__ == '__main__':
+    start = perf_counter()
+    g_table()
+    print('G table built in {:.1f} ms'.format((perf_counter() - start) * 1000))
+    print('{:<32} {:>13} {:>13} {:>9}'.format('benchmark', 'baseline', 'current', 'speedup'))
+    bench_private_key()
+    bench_sign()
+    bench_verify()
+    bench_joint_mul()
+    bench_glv()
+    bench_verify_batch()
+    bench_sec_many()
+    bench_pinned_verify()
+    bench_sign_many()
+    bench_rfc6979()
+    bench_scan_range()
+    bench_recover()
+    bench_multi_scalar_mul()
+    bench_schnorr_batch()
+    bench_base58()
+    bench_base58(count=20, size=20000)
+    bench_bech32()
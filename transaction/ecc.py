@@ -1,10 +1,24 @@
+import hashlib
+import hmac
 from io import BytesIO
-from random import randint
+from multiprocessing import Pool, cpu_count
+from unittest import TestCase
 
-from helper import hash160, encode_base58_checksum, hash256, little_endian_to_int, read_varint
+from helper import (
+    LRUCache, decode_base58_checksum, encode_base58_checksum, hash160, hash256,
+    little_endian_to_int, read_varint,
+)
+from secp256k1 import (
+    A, B, BETA, GX, GY, JACOBIAN_INFINITY, LAMBDA, N, P,
+    affine_add, batch_inverse, batch_to_affine, build_fixed_base_table, encode_sec, field_inv, field_sqrt,
+    fixed_base_mul, g_mul, g_odd_multiples, g_table, glv_mul, glv_split, glv_terms, is_on_curve,
+    jacobian_add, jacobian_double, jacobian_mul, jacobian_to_affine, multi_mul, strauss_mul,
+)
 
 
 class FiniteElement:
+    __slots__ = ('num', 'prime')
+
     def __init__(self, num, prime):
         self.num = num
         self.prime = prime
@@ -46,21 +60,41 @@ class FiniteElement:
         return self.__class__(num=num, prime=self.prime)
 
 
-P = 2 ** 256 - 2 ** 32 - 977
-
-
 class S256Field(FiniteElement):
+    __slots__ = ()
+
     def __init__(self, num, prime=None):
-        super().__init__(num, prime=P)
+        self.num = num
+        self.prime = P
 
     def __repr__(self):
         return '{:x}'.format(self.num).zfill(64)
 
+    def __add__(self, other):
+        return S256Field((self.num + other.num) % P)
+
+    def __sub__(self, other):
+        return S256Field((self.num - other.num) % P)
+
+    def __mul__(self, other):
+        return S256Field(self.num * other.num % P)
+
+    def __rmul__(self, coefficient):
+        return S256Field(self.num * coefficient % P)
+
+    def __pow__(self, exponent):
+        return S256Field(pow(self.num, exponent % (P - 1), P))
+
+    def __truediv__(self, other):
+        return S256Field(self.num * field_inv(other.num) % P)
+
     def sqrt(self):
-        return self ** ((P + 1) // 4)
+        return S256Field(field_sqrt(self.num))
 
 
 class Point:
+    __slots__ = ('a', 'b', 'x', 'y')
+
     def __init__(self, a, b, x, y):
         self.a = a
         self.b = b
@@ -125,11 +159,6 @@ class Point:
             return 'Point({},{})_{}_{}'.format(self.x, self.y, self.a, self.b)
 
 
-A = 0
-B = 7
-N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
-
-
 class Signature:
     def __init__(self, r, s):
         self.r = r
@@ -176,22 +205,113 @@ class Signature:
             raise SyntaxError("Signature too long")
         return cls(r, s)
 
+    def compact(self, recid, compressed=True):
+        '''returns the 65 byte recoverable form: header, r, s'''
+        header = 27 + recid + (4 if compressed else 0)
+        return bytes([header]) + self.r.to_bytes(32, 'big') + self.s.to_bytes(32, 'big')
+
+    @classmethod
+    def parse_compact(cls, compact_bin):
+        '''returns the signature, its recovery id and whether the key
+        is meant to be compressed'''
+        if len(compact_bin) != 65 or not 27 <= compact_bin[0] < 35:
+            raise SyntaxError("Bad compact signature")
+        header = compact_bin[0] - 27
+        sig = cls(int.from_bytes(compact_bin[1:33], 'big'), int.from_bytes(compact_bin[33:], 'big'))
+        return sig, header & 3, header >= 4
+
+    def recover(self, z, recid):
+        '''returns the public key that made this signature over z, recid
+        holding the parity of R.y and, in bit 1, whether R.x overflowed N'''
+        if not (0 < self.r < N and 0 < self.s < N and 0 <= recid < 4):
+            raise ValueError('bad signature or recovery id')
+        x = self.r + (N if recid & 2 else 0)
+        if x >= P:
+            raise ValueError('bad recovery id')
+        alpha = (x * x * x + B) % P
+        y = field_sqrt(alpha)
+        if y * y % P != alpha:
+            raise ValueError('r is not the x of a curve point')
+        if y % 2 != recid & 1:
+            y = P - y
+        # Q = r^-1 (s*R - z*G), a single joint multiplication
+        r_inv = pow(self.r, -1, N)
+        total = strauss_mul((-z * r_inv % N, self.s * r_inv % N), ((GX, GY), (x, y)))
+        point = S256Point.from_jacobian(total)
+        if point.x is None:
+            raise ValueError('recovered the point at infinity')
+        return point
+
+
+def recover_compact(z, compact_bin):
+    '''returns the public key behind a 65 byte compact signature over z'''
+    sig, recid, _ = Signature.parse_compact(compact_bin)
+    return sig.recover(z, recid)
+
 class PrivateKey:
     def __init__(self, secret):
         self.secret = secret
-        self.point = secret * G
+        self._point = None
+        self._nonce_hmac = None
+
+    @property
+    def point(self):
+        # computed on first use, wif() and hex() never need it
+        if self._point is None:
+            self._point = self.secret * G
+        return self._point
 
     def hex(self):
         return '{:x}'.format(self.secret).zfill(64)
 
     def sign(self, z):
-        k = randint(0, N)
-        k_inv = pow(k, N - 2, N)
-        r = (k * G).x.num
+        return self.sign_recoverable(z)[0]
+
+    def sign_recoverable(self, z):
+        '''returns the signature and its recovery id'''
+        k = self.deterministic_k(z)
+        k_inv = pow(k, -1, N)
+        x, y = jacobian_to_affine(g_mul(k))
+        r = x % N
+        recid = (y & 1) | (2 if x >= N else 0)
         s = (z + r * self.secret) * k_inv % N
-        if s > N / 2:
+        if s > N // 2:
+            # negating s is signing with -k, whose R has the other parity
             s = N - s
-        return Signature(r, s)
+            recid ^= 1
+        return Signature(r, s), recid
+
+    def sign_compact(self, z, compressed=True):
+        sig, recid = self.sign_recoverable(z)
+        return sig.compact(recid, compressed)
+
+    def deterministic_k(self, z):
+        '''returns the RFC 6979 nonce for z'''
+        # bits2octets: z is reduced mod N, N itself included
+        z %= N
+        z_bytes = z.to_bytes(32, 'big')
+        secret_bytes = self.secret.to_bytes(32, 'big')
+        v = b'\x01' * 32
+        # the first HMAC is keyed with zeros and its message starts with
+        # V || 0x00 || secret, so that state is computed once per key
+        if self._nonce_hmac is None:
+            self._nonce_hmac = hmac.new(b'\x00' * 32, v + b'\x00' + secret_bytes, hashlib.sha256)
+        state = self._nonce_hmac.copy()
+        state.update(z_bytes)
+        k = state.digest()
+        v = hmac.digest(k, v, 'sha256')
+        k = hmac.digest(k, v + b'\x01' + secret_bytes + z_bytes, 'sha256')
+        v = hmac.digest(k, v, 'sha256')
+        while True:
+            v = hmac.digest(k, v, 'sha256')
+            candidate = int.from_bytes(v, 'big')
+            if 1 <= candidate < N:
+                return candidate
+            k = hmac.digest(k, v + b'\x00', 'sha256')
+            v = hmac.digest(k, v, 'sha256')
+
+    def sign_many(self, zs):
+        return sign_many([(self, z) for z in zs])
 
     def wif(self, compressed=True, testnet=False):
         if testnet:
@@ -203,37 +323,166 @@ class PrivateKey:
             result += b'\x01'
         return encode_base58_checksum(result)
 
+    @classmethod
+    def parse_wif(cls, wif):
+        return cls(parse_wif_many([wif])[0][0])
+
+
+def wif_many(secrets, compressed=True, testnet=False):
+    '''WIF encodes many secrets without any curve arithmetic'''
+    prefix = b'\xef' if testnet else b'\x80'
+    suffix = b'\x01' if compressed else b''
+    return [encode_base58_checksum(prefix + secret.to_bytes(32, 'big') + suffix) for secret in secrets]
+
+
+def parse_wif_many(wifs):
+    '''decodes WIF strings into (secret, compressed, testnet) tuples'''
+    result = []
+    for wif in wifs:
+        raw = decode_base58_checksum(wif)
+        if len(raw) not in (33, 34) or raw[0] not in (0x80, 0xef) \
+                or (len(raw) == 34 and raw[33] != 1):
+            raise ValueError('bad wif: {}'.format(wif))
+        result.append((int.from_bytes(raw[1:33], 'big'), len(raw) == 34, raw[0] == 0xef))
+    return result
+
 
 class S256Point(Point):
+    # sec, hash160 and address results, filled in on first use
+    __slots__ = ('_encodings',)
+    # scalar multiplication engine for points other than G, either
+    # 'jacobian' (plain double-and-add) or 'glv' (endomorphism split)
+    ENGINES = ('jacobian', 'glv')
+    engine = 'jacobian'
+
     def __init__(self, x, y, a=None, b=None):
-        a, b = S256Field(A), S256Field(B)
+        self.a, self.b = S256_A, S256_B
+        self._encodings = None
         if type(x) == int:
-            super().__init__(a=a, b=b, x=S256Field(x), y=S256Field(y))
+            x, y = S256Field(x), S256Field(y)
+        self.x, self.y = x, y
+        if x is None and y is None:
+            return
+        if not is_on_curve(x.num, y.num):
+            raise ValueError("init point failed")
+
+    @classmethod
+    def from_affine(cls, p):
+        '''wraps an affine (x, y) produced by the secp256k1 functions,
+        which are on the curve by construction, skipping the check'''
+        point = cls.__new__(cls)
+        point.a, point.b = S256_A, S256_B
+        point._encodings = None
+        if p is None:
+            point.x = point.y = None
         else:
-            super().__init__(a=a, b=b, x=x, y=y)
+            point.x, point.y = S256Field(p[0]), S256Field(p[1])
+        return point
+
+    def __eq__(self, other):
+        if self.x is None or other.x is None:
+            return self.x is None and other.x is None
+        return self.x.num == other.x.num and self.y.num == other.y.num
+
+    def __add__(self, other):
+        return self.from_affine(affine_add(self.affine(), other.affine()))
+
+    def affine(self):
+        '''returns the integer (x, y) of this point, None for infinity'''
+        if self.x is None:
+            return None
+        return self.x.num, self.y.num
 
     def __rmul__(self, coefficient):
         coef = coefficient % N
-        return super().__rmul__(coef)
+        if self.x is None or coef == 0:
+            return self.from_affine(None)
+        x, y = self.x.num, self.y.num
+        if x == GX and y == GY:
+            return self.from_jacobian(g_mul(coef))
+        if self.engine == 'glv':
+            return self.from_jacobian(glv_mul(x, y, coef))
+        return self.from_jacobian(jacobian_mul(x, y, coef))
+
+    @classmethod
+    def set_engine(cls, engine):
+        if engine not in cls.ENGINES:
+            raise ValueError('unknown engine: {}'.format(engine))
+        cls.engine = engine
+
+    @classmethod
+    def from_jacobian(cls, p):
+        return cls.from_affine(jacobian_to_affine(p))
 
     def verify(self, z, sig):
         s_inv = pow(sig.s, N - 2, N)
         u = z * s_inv % N
         v = sig.r * s_inv % N
-        try:
-            if (u * G + v * self).x.num == sig.r:
-                return True
-        except ValueError:
-            return False
+        table = PINNED_TABLES.get(self.affine())
+        if table is not None:
+            # pinned key: both products are table lookups, no doublings
+            total = jacobian_to_affine(jacobian_add(
+                g_mul(u), fixed_base_mul(table, PIN_WINDOW, v)))
+            return total is not None and total[0] % N == sig.r
+        # u*G + v*P in a single pass, its x coordinate should be r
+        if self.engine == 'glv':
+            terms = glv_terms(u, GX, GY) + glv_terms(v, self.x.num, self.y.num)
+        else:
+            terms = [(u, (GX, GY)), (v, (self.x.num, self.y.num))]
+        coefficients, points = zip(*terms)
+        total = jacobian_to_affine(strauss_mul(coefficients, points))
+        return total is not None and total[0] % N == sig.r
+
+    def pin(self):
+        '''builds and keeps a fixed-base table for this point so that
+        verify against it needs no doublings'''
+        key = self.affine()
+        if key is None:
+            raise ValueError('cannot pin the point at infinity')
+        # a membership test, so that pinning does not count as a miss
+        if key not in PINNED_TABLES:
+            PINNED_TABLES.put(key, build_fixed_base_table(*key, PIN_WINDOW))
+
+    @classmethod
+    def warm(cls, pubkeys):
+        '''pins every public key, given as S256Points or SEC bytes'''
+        for pubkey in pubkeys:
+            if not isinstance(pubkey, S256Point):
+                pubkey = cls.parse(pubkey)
+            pubkey.pin()
+
+    @classmethod
+    def verify_batch(cls, items, processes=None):
+        '''verifies (point, z, sig) triples across a process pool and
+        returns the results in the order of items'''
+        jobs = [(point.x.num, point.y.num, z, sig.r, sig.s) for point, z, sig in items]
+        processes = processes or cpu_count()
+        if processes == 1 or len(jobs) < VERIFY_BATCH_MIN:
+            return [_verify_job(job) for job in jobs]
+        # build the G tables before forking so that workers share them
+        _init_verify_worker(cls.engine)
+        chunksize = max(1, len(jobs) // (processes * 4))
+        with Pool(processes, _init_verify_worker, (cls.engine,)) as pool:
+            return pool.map(_verify_job, jobs, chunksize)
+
+    verify_many = verify_batch
+
+    @classmethod
+    def from_jacobian_many(cls, points):
+        '''converts jacobian points to S256Points with a single inversion'''
+        return [cls.from_affine(p) for p in batch_to_affine(points)]
+
+    def _memo(self, key):
+        if self._encodings is None:
+            self._encodings = {}
+        return self._encodings.get(key)
 
     def sec(self, compressed=True):
-        if not compressed:
-            return b'\x04' + self.x.num.to_bytes(32, 'big') + self.y.num.to_bytes(32, 'big')
-        if compressed:
-            if self.y.num % 2 == 0:
-                return b'\x02' + self.x.num.to_bytes(32, 'big')
-            else:
-                return b'\x03' + self.x.num.to_bytes(32, 'big')
+        key = ('sec', compressed)
+        result = self._memo(key)
+        if result is None:
+            result = self._encodings[key] = encode_sec(self.x.num, self.y.num, compressed)
+        return result
 
     @classmethod
     def parse(cls, sec_bin):
@@ -241,33 +490,307 @@ class S256Point(Point):
             x = int.from_bytes(sec_bin[1:33], 'big')
             y = int.from_bytes(sec_bin[33:65], 'big')
             return S256Point(x, y)
+        # decompressing costs a 256 bit exponentiation, so remember the
+        # keys we have already seen
+        key = bytes(sec_bin)
+        cached = SEC_CACHE.get(key)
+        if cached is not None:
+            return cls.from_affine(cached)
         is_even = sec_bin[0] == 2
-        x = S256Field(int.from_bytes(sec_bin[1:], 'big'))
-        alpha = x ** 3 + S256Field(B)
-        beta = alpha.sqrt()
-        if beta.num % 2 == 0:
+        x = int.from_bytes(sec_bin[1:], 'big')
+        beta = field_sqrt((x * x * x + B) % P)
+        if beta % 2 == 0:
             even_beta = beta
-            odd_beta = S256Field(P - beta.num)
+            odd_beta = P - beta
         else:
             odd_beta = beta
-            even_beta = S256Field(P - beta.num)
+            even_beta = P - beta
         if is_even:
-            return S256Point(x, odd_beta)
+            point = S256Point(x, even_beta)
         else:
-            return S256Point(x, odd_beta)
+            point = S256Point(x, odd_beta)
+        SEC_CACHE.put(key, (x, point.y.num))
+        return point
 
     def hash160(self, compressed=True):
-        return hash160(self.sec(compressed))
+        key = ('hash160', compressed)
+        result = self._memo(key)
+        if result is None:
+            result = self._encodings[key] = hash160(self.sec(compressed))
+        return result
 
     def address(self, compressed=True, testnet=False):
-        h160 = self.hash160(compressed)
-        if testnet:
-            prefix = b'\x6f'
-        else:
-            prefix = b'\x00'
-        return encode_base58_checksum(prefix + h160)
+        key = ('address', compressed, testnet)
+        result = self._memo(key)
+        if result is None:
+            h160 = self.hash160(compressed)
+            if testnet:
+                prefix = b'\x6f'
+            else:
+                prefix = b'\x00'
+            result = self._encodings[key] = encode_base58_checksum(prefix + h160)
+        return result
+
+
+# decompressed SEC public keys, resize with SEC_CACHE.resize(n)
+SEC_CACHE = LRUCache(4096)
+
+# fixed-base tables of pinned public keys, see S256Point.pin
+PIN_WINDOW = 6
+PINNED_TABLES = LRUCache(64)
 
+S256_A = S256Field(A)
+S256_B = S256Field(B)
+G = S256Point(GX, GY)
 
-G = S256Point(
-    0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
-    0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
+
+def sign_many(items):
+    '''signs (private_key, z) pairs, which may mix several keys, computing
+    all the k*G points and nonce inverses with one inversion each'''
+    ks = [private_key.deterministic_k(z) for private_key, z in items]
+    rs = [x % N for x, _ in batch_to_affine([g_mul(k) for k in ks])]
+    k_invs = batch_inverse(ks, N)
+    signatures = []
+    for (private_key, z), r, k_inv in zip(items, rs, k_invs):
+        s = (z + r * private_key.secret) * k_inv % N
+        if s > N // 2:
+            s = N - s
+        signatures.append(Signature(r, s))
+    return signatures
+
+
+def multi_scalar_mul(scalars, points):
+    '''returns the S256Point sum of scalar * point, computed in one pass
+    (Strauss for few points, Pippenger buckets for many)'''
+    total = multi_mul(scalars, [p.affine() for p in points])
+    return S256Point.from_jacobian(total)
+
+
+def sec_many(points, compressed=True):
+    '''returns the SEC encodings of S256Points and/or jacobian (X, Y, Z)
+    triples, normalizing all the jacobian ones with a single inversion'''
+    jacobian = [p for p in points if not isinstance(p, S256Point)]
+    affine = iter(batch_to_affine(jacobian))
+    result = []
+    for p in points:
+        if isinstance(p, S256Point):
+            result.append(p.sec(compressed))
+        else:
+            result.append(encode_sec(*next(affine), compressed))
+    return result
+
+
+# below this many signatures verify_batch does not start a pool
+VERIFY_BATCH_MIN = 64
+
+
+def _init_verify_worker(engine):
+    S256Point.set_engine(engine)
+    g_table()
+    g_odd_multiples(GX, GY)
+
+
+def _verify_job(job):
+    x, y, z, r, s = job
+    return S256Point(x, y).verify(z, Signature(r, s))
+
+
+class ECCTest(TestCase):
+
+    def test_rmul(self):
+        for secret in (1, 2, 7, 0xdeadbeef, N - 1, 2 ** 255 + 12345):
+            want = Point.__rmul__(G, secret)
+            self.assertEqual(secret * G, want)
+        self.assertIsNone((N * G).x)
+
+    def test_g_mul(self):
+        for secret in (1, 255, 256, 0x1234567890abcdef, N - 1):
+            want = jacobian_to_affine(jacobian_mul(G.x.num, G.y.num, secret))
+            self.assertEqual(jacobian_to_affine(g_mul(secret)), want)
+        self.assertEqual(g_mul(N), JACOBIAN_INFINITY)
+
+    def test_strauss_mul(self):
+        point = 0xabcdef * G
+        points = ((G.x.num, G.y.num), (point.x.num, point.y.num))
+        for u, v in ((1, 1), (N - 1, 2), (0xdeadbeef, 2 ** 200 + 7), (0, 5), (-3, 4)):
+            want = u * G + v * point
+            got = S256Point.from_jacobian(strauss_mul((u, v), points))
+            self.assertEqual(got, want)
+
+    def test_glv(self):
+        self.assertEqual(BETA * G.x.num % P, (LAMBDA * G).x.num)
+        point = 0x1badcafe * G
+        for secret in (1, 3, 0xdeadbeef, N // 2, N - 1, 2 ** 256 - 1):
+            k1, k2 = glv_split(secret % N)
+            self.assertEqual((k1 + k2 * LAMBDA) % N, secret % N)
+            self.assertLess(max(abs(k1), abs(k2)), 2 ** 129)
+            want = Point.__rmul__(point, secret % N)
+            got = S256Point.from_jacobian(glv_mul(point.x.num, point.y.num, secret))
+            self.assertEqual(got, want)
+
+    def test_engine(self):
+        point = 0xfeedface * G
+        sig = PrivateKey(0xfeedface).sign(0x1234)
+        want = 0xabcdef0123456789 * point
+        S256Point.set_engine('glv')
+        try:
+            self.assertEqual(0xabcdef0123456789 * point, want)
+            self.assertTrue(point.verify(0x1234, sig))
+            self.assertFalse(point.verify(0x1235, sig))
+        finally:
+            S256Point.set_engine('jacobian')
+        with self.assertRaises(ValueError):
+            S256Point.set_engine('nope')
+
+    def test_verify_batch(self):
+        items = []
+        for secret in range(1, 9):
+            private_key = PrivateKey(secret * 0x10001)
+            z = secret * 0x1234567
+            items.append((private_key.point, z, private_key.sign(z)))
+        items.append((items[0][0], items[0][1] + 1, items[0][2]))
+        want = [True] * 8 + [False]
+        self.assertEqual(S256Point.verify_batch(items), want)
+        self.assertEqual(S256Point.verify_many(items * 10, processes=2), want * 10)
+
+    def test_batch_to_affine(self):
+        points = [jacobian_mul(G.x.num, G.y.num, k) for k in (1, 2, 0xbeef, N - 5)]
+        points.insert(2, JACOBIAN_INFINITY)
+        want = [jacobian_to_affine(p) for p in points]
+        self.assertEqual(batch_to_affine(points), want)
+        self.assertEqual(batch_inverse([3, 0, 5], 7), [5, 0, 3])
+
+    def test_sec_many(self):
+        points = [k * G for k in (1, 0x5ec, N - 1)]
+        jacobian = [jacobian_mul(p.x.num, p.y.num, 1) for p in points]
+        jacobian[1] = jacobian_double(jacobian_mul(points[1].x.num, points[1].y.num, 2 ** 255))
+        points[1] = 2 ** 256 * points[1]
+        for compressed in (True, False):
+            want = [p.sec(compressed) for p in points]
+            self.assertEqual(sec_many(jacobian, compressed), want)
+            self.assertEqual(sec_many(points[:1] + jacobian[1:], compressed), want)
+
+    def test_parse(self):
+        for secret in (5001, 2019 ** 5, 0xdeadbeef12345):
+            point = secret * G
+            for compressed in (True, False):
+                self.assertEqual(S256Point.parse(point.sec(compressed)), point)
+        SEC_CACHE.clear()
+        sec = G.sec()
+        S256Point.parse(sec)
+        self.assertEqual(S256Point.parse(sec), G)
+        self.assertEqual(SEC_CACHE.stats()['hits'], 1)
+        self.assertEqual(SEC_CACHE.stats()['misses'], 1)
+
+    def test_pin(self):
+        private_key = PrivateKey(0x9e11ed)
+        point = private_key.point
+        z = 0x5a1e
+        sig = private_key.sign(z)
+        PINNED_TABLES.clear()
+        S256Point.warm([point.sec()])
+        self.assertEqual(len(PINNED_TABLES), 1)
+        self.assertTrue(point.verify(z, sig))
+        self.assertFalse(point.verify(z + 1, sig))
+        self.assertEqual(PINNED_TABLES.stats()['hits'], 2)
+        self.assertEqual(PINNED_TABLES.stats()['misses'], 0)
+        with self.assertRaises(ValueError):
+            (N * G).pin()
+        PINNED_TABLES.clear()
+
+    def test_sign_many(self):
+        keys = [PrivateKey(secret) for secret in (0x51, 0x6e, 0x7a11)]
+        items = [(keys[i % 3], 0xabc + i) for i in range(7)]
+        for (private_key, z), sig in zip(items, sign_many(items)):
+            self.assertTrue(private_key.point.verify(z, sig))
+            self.assertLessEqual(sig.s, N // 2)
+        sigs = keys[0].sign_many([1, 2])
+        self.assertTrue(keys[0].point.verify(2, sigs[1]))
+
+    def test_deterministic_k(self):
+        z = int.from_bytes(hashlib.sha256(b'Satoshi Nakamoto').digest(), 'big')
+        private_key = PrivateKey(1)
+        want = 0x8f8a276c19f4149656b280621e358cce24f5f52542772691ee69063b74f15d15
+        self.assertEqual(private_key.deterministic_k(z), want)
+        self.assertEqual(private_key.deterministic_k(z), want)
+        sig = private_key.sign(z)
+        self.assertEqual(private_key.sign(z).der(), sig.der())
+        self.assertTrue(private_key.point.verify(z, sig))
+        self.assertEqual(private_key.deterministic_k(N), private_key.deterministic_k(0))
+        self.assertEqual(private_key.deterministic_k(N + 5), private_key.deterministic_k(5))
+
+    def test_recover(self):
+        for secret in (1, 0xc0ffee, N - 2):
+            private_key = PrivateKey(secret)
+            for z in (0x1, 0xfeedbeef, 2 ** 256 - 1):
+                sig, recid = private_key.sign_recoverable(z)
+                self.assertEqual(sig.recover(z, recid), private_key.point)
+                self.assertNotEqual(sig.recover(z, recid ^ 1), private_key.point)
+                compact = private_key.sign_compact(z, compressed=False)
+                self.assertEqual(len(compact), 65)
+                self.assertEqual(recover_compact(z, compact), private_key.point)
+                self.assertFalse(Signature.parse_compact(compact)[2])
+        with self.assertRaises(SyntaxError):
+            Signature.parse_compact(b'\x1a' + b'\x01' * 64)
+
+    def test_verify_overflowed_r(self):
+        # R.x >= N: r is R.x - N and the point is solved for from u*G + v*P = R
+        x = N + 1
+        while pow(field_sqrt((x ** 3 + B) % P), 2, P) != (x ** 3 + B) % P:
+            x += 1
+        big_r = S256Point(x, field_sqrt((x ** 3 + B) % P))
+        z, r, s = 0xabc, x - N, 0x1234567
+        s_inv = pow(s, -1, N)
+        point = pow(r * s_inv, -1, N) * (big_r + (N - z * s_inv % N) * G)
+        sig = Signature(r, s)
+        self.assertTrue(point.verify(z, sig))
+        PINNED_TABLES.clear()
+        point.pin()
+        self.assertTrue(point.verify(z, sig))
+        PINNED_TABLES.clear()
+        self.assertEqual(sig.recover(z, 2 | (big_r.y.num & 1)), point)
+
+    def test_multi_scalar_mul(self):
+        points = [k * G for k in range(1, 200)] + [S256Point(None, None)]
+        scalars = [k ** 7 + 3 for k in range(200)]
+        for n in (0, 1, 2, 16, 200):
+            want = S256Point(None, None)
+            for scalar, point in zip(scalars[:n], points[:n]):
+                want += scalar * point
+            self.assertEqual(multi_scalar_mul(scalars[:n], points[:n]), want)
+
+    def test_wif(self):
+        private_key = PrivateKey(5003)
+        self.assertEqual(private_key.wif(compressed=True, testnet=True),
+                         'cMahea7zqjxrtgAbB7LSGbcQUr1uX1ojuat9jZodMN8rFTv2sfUK')
+        self.assertIsNone(private_key._point)
+        secrets = [5003, 2021 ** 5, 0x54321deadbeef]
+        for compressed in (True, False):
+            for testnet in (True, False):
+                wifs = wif_many(secrets, compressed, testnet)
+                self.assertEqual(wifs, [PrivateKey(s).wif(compressed, testnet) for s in secrets])
+                self.assertEqual(parse_wif_many(wifs), [(s, compressed, testnet) for s in secrets])
+        self.assertEqual(PrivateKey.parse_wif(wifs[1]).secret, secrets[1])
+        with self.assertRaises(ValueError):
+            parse_wif_many([encode_base58_checksum(b'\x00' * 33)])
+        with self.assertRaises(ValueError):
+            parse_wif_many([encode_base58_checksum(b'')])
+
+    def test_encodings(self):
+        point = PrivateKey(888 ** 3).point
+        self.assertEqual(point.address(compressed=True, testnet=False), '148dY81A9BmdpMhvYEVznrM45kWN32vSCN')
+        self.assertEqual(point.address(compressed=True, testnet=False), '148dY81A9BmdpMhvYEVznrM45kWN32vSCN')
+        self.assertEqual(point.address(compressed=True, testnet=True), 'mieaqB68xDCtbUBYFoUNcmZNwk74xcBfTP')
+        self.assertEqual(point.hash160(False), hash160(point.sec(False)))
+        self.assertIs(point.sec(), point.sec())
+        self.assertEqual(len(point._encodings), 6)
+
+    def test_verify(self):
+        point = S256Point(
+            0x887387e452b8eacc4acfde10d9aaf7f6d9a0f975aabb10d006e4da568744d06c,
+            0x61de6d95231cd89026e286df3b6ae4a894a3378e393e93a0f45b666329a0ae34)
+        z = 0xec208baa0fc1c19f708a9ca96fdeff3ac3f230bb4a7ba4aede4942ad003c0f60
+        r = 0xac8d1c87e51d0d441be8b3dd5b05c8795b48875dffe00b7ffcfac23010d3a395
+        s = 0x68342ceff8935ededd102dd876ffd6ba72d6a427a3edb13d26eb0781cb423c4
+        self.assertTrue(point.verify(z, Signature(r, s)))
+        self.assertFalse(point.verify(z + 1, Signature(r, s)))
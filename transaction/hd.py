@@ -0,0 +1,223 @@
+'''
+BIP32 hierarchical deterministic keys on top of ecc.py. Intermediate
+nodes are kept in a bounded cache so that deriving m/84'/0'/0'/0/i for
+consecutive i only performs the last step.
+'''
+import hmac
+from unittest import TestCase
+
+from ecc import N, PrivateKey, S256Point
+from helper import LRUCache, decode_base58_checksum, encode_base58_checksum, hash160
+from secp256k1 import batch_to_affine, g_mul, jacobian_add_affine
+
+
+HARDENED = 0x80000000
+XPRV = bytes.fromhex('0488ade4')
+XPUB = bytes.fromhex('0488b21e')
+TPRV = bytes.fromhex('04358394')
+TPUB = bytes.fromhex('043587cf')
+
+# derived nodes keyed by (parent chain code, parent key, network, path), resize
+# with NODE_CACHE.resize(n)
+NODE_CACHE = LRUCache(4096)
+
+
+def parse_path(path):
+    '''turns "m/84'/0'/0'/0/5" into a list of child numbers'''
+    parts = path.split('/')
+    if parts[0] in ('m', 'M'):
+        parts = parts[1:]
+    indices = []
+    for part in parts:
+        if not part:
+            continue
+        if part[-1] in "'hH":
+            indices.append(int(part[:-1]) + HARDENED)
+        else:
+            indices.append(int(part))
+    return indices
+
+
+class HDKey:
+
+    def __init__(self, chain_code, private_key=None, point=None, depth=0,
+                 parent_fingerprint=b'\x00\x00\x00\x00', child_number=0, testnet=False):
+        self.chain_code = chain_code
+        self.private_key = private_key
+        self._point = point
+        self.depth = depth
+        self.parent_fingerprint = parent_fingerprint
+        self.child_number = child_number
+        self.testnet = testnet
+
+    def __repr__(self):
+        # never the xprv, so printing a key does not leak its secret
+        return self.xpub()
+
+    @classmethod
+    def from_seed(cls, seed, testnet=False):
+        i = hmac.digest(b'Bitcoin seed', seed, 'sha512')
+        return cls(i[32:], PrivateKey(int.from_bytes(i[:32], 'big')), testnet=testnet)
+
+    @property
+    def point(self):
+        if self._point is None:
+            self._point = self.private_key.point
+        return self._point
+
+    def fingerprint(self):
+        return hash160(self.point.sec())[:4]
+
+    def neuter(self):
+        '''returns the public-only version of this key'''
+        return self.__class__(
+            self.chain_code, point=self.point, depth=self.depth,
+            parent_fingerprint=self.parent_fingerprint,
+            child_number=self.child_number, testnet=self.testnet)
+
+    def _tweak(self, index):
+        if index >= HARDENED:
+            if self.private_key is None:
+                raise ValueError('cannot derive a hardened child from a public key')
+            data = b'\x00' + self.private_key.secret.to_bytes(32, 'big')
+        else:
+            data = self.point.sec()
+        i = hmac.digest(self.chain_code, data + index.to_bytes(4, 'big'), 'sha512')
+        tweak = int.from_bytes(i[:32], 'big')
+        if tweak >= N:
+            raise ValueError('invalid child {}, use the next index'.format(index))
+        return tweak, i[32:]
+
+    def child(self, index):
+        '''derives the child key at index, hardened when index >= 2^31'''
+        return self.children([index])[0]
+
+    def children(self, indices):
+        '''derives several children at once, normalizing the public
+        children's points with a single inversion'''
+        tweaks = [self._tweak(index) for index in indices]
+        fingerprint = self.fingerprint()
+        if self.private_key is not None:
+            keys = [((self.private_key.secret + tweak) % N, None) for tweak, _ in tweaks]
+        else:
+            x, y = self.point.x.num, self.point.y.num
+            points = batch_to_affine([jacobian_add_affine(g_mul(tweak), x, y) for tweak, _ in tweaks])
+            keys = [(None, S256Point.from_affine(p)) for p in points]
+        result = []
+        for index, (_, chain_code), (secret, point) in zip(indices, tweaks, keys):
+            if secret == 0 or (point is not None and point.x is None):
+                raise ValueError('invalid child {}, use the next index'.format(index))
+            result.append(self.__class__(
+                chain_code, private_key=None if secret is None else PrivateKey(secret), point=point,
+                depth=self.depth + 1, parent_fingerprint=fingerprint,
+                child_number=index, testnet=self.testnet))
+        return result
+
+    def _cache_id(self):
+        if self.private_key is not None:
+            return self.chain_code, self.private_key.secret, self.testnet
+        return self.chain_code, self.point.sec(), self.testnet
+
+    def derive(self, path):
+        '''derives the key at path (a string or list of child numbers)
+        relative to this key, reusing cached intermediate nodes'''
+        if isinstance(path, str):
+            path = parse_path(path)
+        path = tuple(path)
+        cache_id = self._cache_id()
+        node, done = self, 0
+        for i in range(len(path), 0, -1):
+            cached = NODE_CACHE.get((cache_id, path[:i]))
+            if cached is not None:
+                node, done = cached, i
+                break
+        for i in range(done, len(path)):
+            node = node.child(path[i])
+            NODE_CACHE.put((cache_id, path[:i + 1]), node)
+        return node
+
+    def derive_range(self, path, start, count):
+        '''returns the children start .. start + count - 1 of the node at path'''
+        return self.derive(path).children(list(range(start, start + count)))
+
+    def _serialize(self, version, key_data):
+        return encode_base58_checksum(
+            version + bytes([self.depth]) + self.parent_fingerprint
+            + self.child_number.to_bytes(4, 'big') + self.chain_code + key_data)
+
+    def xprv(self):
+        if self.private_key is None:
+            raise ValueError('public key has no xprv')
+        version = TPRV if self.testnet else XPRV
+        return self._serialize(version, b'\x00' + self.private_key.secret.to_bytes(32, 'big'))
+
+    def xpub(self):
+        version = TPUB if self.testnet else XPUB
+        return self._serialize(version, self.point.sec())
+
+    @classmethod
+    def parse(cls, s):
+        '''parses an xprv, xpub, tprv or tpub string'''
+        raw = decode_base58_checksum(s)
+        if len(raw) != 78:
+            raise ValueError('bad extended key length: {}'.format(len(raw)))
+        version, key_data = raw[:4], raw[45:]
+        if version not in (XPRV, XPUB, TPRV, TPUB):
+            raise ValueError('unknown version: {}'.format(version.hex()))
+        fields = dict(
+            depth=raw[4],
+            parent_fingerprint=raw[5:9],
+            child_number=int.from_bytes(raw[9:13], 'big'),
+            testnet=version in (TPRV, TPUB),
+        )
+        if version in (XPRV, TPRV):
+            if key_data[0] != 0:
+                raise ValueError('bad private key prefix')
+            return cls(raw[13:45], private_key=PrivateKey(int.from_bytes(key_data[1:], 'big')), **fields)
+        return cls(raw[13:45], point=S256Point.parse(key_data), **fields)
+
+
+class HDTest(TestCase):
+
+    def test_bip32_vector_1(self):
+        master = HDKey.from_seed(bytes.fromhex('000102030405060708090a0b0c0d0e0f'))
+        self.assertEqual(master.xpub(), 'xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8')
+        child = master.derive("m/0'")
+        self.assertEqual(child.xprv(), 'xprv9uHRZZhk6KAJC1avXpDAp4MDc3sQKNxDiPvvkX8Br5ngLNv1TxvUxt4cV1rGL5hj6KCesnDYUhd7oWgT11eZG7XnxHrnYeSvkzY7d2bhkJ7')
+        self.assertEqual(child.xpub(), 'xpub68Gmy5EdvgibQVfPdqkBBCHxA5htiqg55crXYuXoQRKfDBFA1WEjWgP6LHhwBZeNK1VTsfTFUHCdrfp1bgwQ9xv5ski8PX9rL2dZXvgGDnw')
+
+    def test_parse(self):
+        master = HDKey.from_seed(b'\x42' * 32, testnet=True)
+        for key in (master, master.derive("m/1/2'/3"), master.derive('m/5/6').neuter()):
+            if key.private_key:
+                self.assertEqual(HDKey.parse(key.xprv()).xprv(), key.xprv())
+            self.assertEqual(HDKey.parse(key.xpub()).xpub(), key.xpub())
+
+    def test_public_derivation(self):
+        account = HDKey.from_seed(b'\x07' * 32).derive("m/84'/0'/0'")
+        xpub = HDKey.parse(account.neuter().xpub())
+        private = account.derive_range('0', 3, 4)
+        public = xpub.derive_range('0', 3, 4)
+        for a, b in zip(private, public):
+            self.assertEqual(a.xpub(), b.xpub())
+        self.assertEqual(account.derive('0/5').xpub(), public[2].xpub())
+        with self.assertRaises(ValueError):
+            xpub.child(HARDENED)
+
+    def test_node_cache(self):
+        master = HDKey.from_seed(b'\x01' * 16)
+        NODE_CACHE.clear()
+        master.derive("m/84'/0'/0'/0/0")
+        self.assertEqual(len(NODE_CACHE), 5)
+        master.derive("m/84'/0'/0'/0/1")
+        self.assertEqual(len(NODE_CACHE), 6)
+        self.assertGreaterEqual(NODE_CACHE.hits, 1)
+
+    def test_node_cache_network(self):
+        seed = b'\x02' * 16
+        testnet = HDKey.from_seed(seed, testnet=True).derive("m/0'/1")
+        mainnet = HDKey.from_seed(seed).derive("m/0'/1")
+        self.assertTrue(testnet.xprv().startswith('tprv'))
+        self.assertTrue(mainnet.xprv().startswith('xprv'))
+        self.assertFalse(mainnet.testnet)
+        self.assertEqual(repr(mainnet), mainnet.xpub())
@@ -1,3 +1,7 @@
+from collections import OrderedDict
+from io import BytesIO
+from struct import Struct
+from threading import Lock
 from unittest import TestCase, TestSuite, TextTestRunner
 
 import hashlib
@@ -25,43 +29,258 @@ def hash256(s):
     return hashlib.sha256(hashlib.sha256(s).digest()).digest()
 
 
+BASE58_INDEX = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+
+# numbers below 58^40 are converted two digits at a time with a table,
+# larger numbers are first split in halves by divmod with 58^(10 * 2^i)
+# rather than peeling one digit at a time off the whole number
+BASE58_CHUNK = 10
+_BASE58_POWERS = [(58 ** BASE58_CHUNK, BASE58_CHUNK)]
+# every two digit string, indexed by its value below 58^2
+_BASE58_PAIRS = [a + b for a in BASE58_ALPHABET for b in BASE58_ALPHABET]
+
+
+def _grow_base58_powers():
+    power, digits = _BASE58_POWERS[-1]
+    _BASE58_POWERS.append((power * power, digits * 2))
+
+
+def _base58_digits(num, level, width=0):
+    '''base58 digits of num < 58^(20 * 2^level), left padded with '1'
+    to width'''
+    if level < 2:
+        result = []
+        while num > 0:
+            num, mod = divmod(num, 3364)
+            result.append(_BASE58_PAIRS[mod])
+        return ''.join(reversed(result)).lstrip('1').rjust(width, '1')
+    power, digits = _BASE58_POWERS[level]
+    if num < power and width <= digits:
+        return _base58_digits(num, level - 1, width)
+    high, low = divmod(num, power)
+    return _base58_digits(high, level - 1, max(width - digits, 0)) + _base58_digits(low, level - 1, digits)
+
+
 def encode_base58(s):
     # determine how many 0 bytes (b'\x00') s starts with
-    count = 0
-    for c in s:
-        if c == 0:
-            count += 1
-        else:
-            break
+    count = len(s) - len(s.lstrip(b'\x00'))
     # convert to big endian integer
     num = int.from_bytes(s, 'big')
-    prefix = '1' * count
-    result = ''
-    while num > 0:
-        num, mod = divmod(num, 58)
-        result = BASE58_ALPHABET[mod] + result
-    return prefix + result
+    while _BASE58_POWERS[-1][0] <= num:
+        _grow_base58_powers()
+    return '1' * count + _base58_digits(num, len(_BASE58_POWERS) - 2)
 
 
 def encode_base58_checksum(s):
     return encode_base58(s + hash256(s)[:4])
 
 
+def _base58_value(s):
+    '''the number written by the base58 digits s'''
+    if len(s) > 4 * BASE58_CHUNK:
+        while _BASE58_POWERS[-1][1] * 2 < len(s):
+            _grow_base58_powers()
+        i = len(_BASE58_POWERS) - 1
+        while _BASE58_POWERS[i][1] >= len(s):
+            i -= 1
+        power, digits = _BASE58_POWERS[i]
+        return _base58_value(s[:-digits]) * power + _base58_value(s[-digits:])
+    num = 0
+    for start in range(0, len(s), BASE58_CHUNK):
+        chunk = s[start:start + BASE58_CHUNK]
+        value = 0
+        for c in chunk:
+            digit = BASE58_INDEX.get(c)
+            if digit is None:
+                raise ValueError('invalid base58 character: {!r}'.format(c))
+            value = value * 58 + digit
+        num = num * 58 ** len(chunk) + value
+    return num
+
+
+def decode_base58_raw(s):
+    '''decodes a base58 string of any length into bytes, each leading '1'
+    becoming a zero byte'''
+    num = _base58_value(s)
+    zeros = len(s) - len(s.lstrip('1'))
+    return b'\x00' * zeros + num.to_bytes((num.bit_length() + 7) // 8, 'big')
+
+
 # tag::source1[]
 def decode_base58(s):
-    num = 0
-    for c in s:  # <1>
-        num *= 58
-        num += BASE58_ALPHABET.index(c)
-    combined = num.to_bytes(25, byteorder='big')  # <2>
+    combined = decode_base58_raw(s)  # <1>
     checksum = combined[-4:]
     if hash256(combined[:-4])[:4] != checksum:
         raise ValueError('bad address: {} {}'.format(checksum,
           hash256(combined[:-4])[:4]))
-    return combined[1:-4]  # <3>
+    return combined[1:-4]  # <2>
 # end::source1[]
 
 
+def decode_base58_checksum(s):
+    '''decodes a base58check string of any length and returns the
+    payload, version bytes included, without the checksum'''
+    combined = decode_base58_raw(s)
+    payload, checksum = combined[:-4], combined[-4:]
+    if hash256(payload)[:4] != checksum:
+        raise ValueError('bad checksum: {} {}'.format(checksum, hash256(payload)[:4]))
+    return payload
+
+
+def encode_base58_many(payloads, checksum=True):
+    '''encodes an iterable of byte strings, with the 4 byte checksum
+    appended unless checksum is False'''
+    if checksum:
+        return [encode_base58_checksum(payload) for payload in payloads]
+    return [encode_base58(payload) for payload in payloads]
+
+
+def decode_base58_many(strings, checksum=True):
+    '''decodes an iterable of base58 strings, verifying and removing the
+    checksum unless checksum is False'''
+    if checksum:
+        return [decode_base58_checksum(s) for s in strings]
+    return [decode_base58_raw(s) for s in strings]
+
+
+BECH32_ALPHABET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_INDEX = {c: i for i, c in enumerate(BECH32_ALPHABET)}
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+BECH32_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+# the generator terms to xor in for each value of the top 5 bits
+BECH32_TABLE = [0] * 32
+for _top in range(32):
+    for _i, _gen in enumerate(BECH32_GENERATOR):
+        if _top >> _i & 1:
+            BECH32_TABLE[_top] ^= _gen
+del _top, _i, _gen
+# polymod state after the expanded human readable part, per hrp
+_BECH32_HRP_STATES = {}
+
+
+def bech32_polymod(values, chk=1):
+    '''the BIP173 checksum polynomial of the 5 bit values, continuing
+    from chk'''
+    table = BECH32_TABLE
+    for value in values:
+        chk = (chk & 0x1ffffff) << 5 ^ value ^ table[chk >> 25]
+    return chk
+
+
+def _bech32_hrp_state(hrp):
+    state = _BECH32_HRP_STATES.get(hrp)
+    if state is None:
+        expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+        state = _BECH32_HRP_STATES[hrp] = bech32_polymod(expanded)
+    return state
+
+
+def convert_bits(data, from_bits, to_bits, pad=True):
+    '''regroups a sequence of from_bits wide integers into to_bits wide
+    ones'''
+    acc = 0
+    bits = 0
+    result = []
+    maxv = (1 << to_bits) - 1
+    for value in data:
+        if value >> from_bits:
+            raise ValueError('value out of range: {}'.format(value))
+        acc = (acc << from_bits | value) & 0xffffffff
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append(acc >> bits & maxv)
+    if pad:
+        if bits:
+            result.append(acc << (to_bits - bits) & maxv)
+    elif bits >= from_bits or acc << (to_bits - bits) & maxv:
+        raise ValueError('invalid padding')
+    return result
+
+
+def bech32_encode(hrp, data, const=BECH32_CONST):
+    '''encodes the 5 bit values data, const picks bech32 or bech32m'''
+    chk = bech32_polymod(data, _bech32_hrp_state(hrp))
+    polymod = bech32_polymod([0] * 6, chk) ^ const
+    checksum = [polymod >> 5 * (5 - i) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(BECH32_ALPHABET[d] for d in data + checksum)
+
+
+def bech32_decode(s):
+    '''returns the hrp, the 5 bit values without the checksum and the
+    checksum constant (BECH32_CONST or BECH32M_CONST)'''
+    if len(s) > 90:
+        raise ValueError('bech32 string too long: {}'.format(len(s)))
+    if s.lower() != s and s.upper() != s:
+        raise ValueError('mixed case bech32 string')
+    s = s.lower()
+    pos = s.rfind('1')
+    if pos < 1 or pos + 7 > len(s):
+        raise ValueError('bad bech32 separator position')
+    hrp = s[:pos]
+    if any(ord(c) < 33 or ord(c) > 126 for c in hrp):
+        raise ValueError('bad bech32 hrp: {!r}'.format(hrp))
+    try:
+        data = [BECH32_INDEX[c] for c in s[pos + 1:]]
+    except KeyError as e:
+        raise ValueError('invalid bech32 character: {!r}'.format(e.args[0]))
+    const = bech32_polymod(data, _bech32_hrp_state(hrp))
+    if const not in (BECH32_CONST, BECH32M_CONST):
+        raise ValueError('bad bech32 checksum')
+    return hrp, data[:-6], const
+
+
+def encode_segwit_address(version, program, testnet=False):
+    '''bech32 (version 0) or bech32m (version 1 and up) address of a
+    witness program'''
+    hrp = 'tb' if testnet else 'bc'
+    const = BECH32_CONST if version == 0 else BECH32M_CONST
+    return bech32_encode(hrp, [version] + convert_bits(program, 8, 5), const)
+
+
+def decode_segwit_address(address, testnet=False):
+    '''returns the witness version and program of a segwit address'''
+    hrp, data, const = bech32_decode(address)
+    if hrp != ('tb' if testnet else 'bc'):
+        raise ValueError('wrong network: {}'.format(hrp))
+    if not data or data[0] > 16:
+        raise ValueError('bad witness version')
+    version = data[0]
+    program = bytes(convert_bits(data[1:], 5, 8, False))
+    if not 2 <= len(program) <= 40:
+        raise ValueError('bad witness program length: {}'.format(len(program)))
+    if version == 0 and len(program) not in (20, 32):
+        raise ValueError('bad version 0 program length: {}'.format(len(program)))
+    if const != (BECH32_CONST if version == 0 else BECH32M_CONST):
+        raise ValueError('wrong checksum variant for version {}'.format(version))
+    return version, program
+
+
+def address_to_script_pubkey(address, testnet=False):
+    '''returns the raw ScriptPubKey bytes paying to a p2pkh, p2sh or
+    segwit address'''
+    hrp = 'tb1' if testnet else 'bc1'
+    if address[:3].lower() == hrp:
+        version, program = decode_segwit_address(address, testnet)
+        return bytes([version + 0x50 if version else 0, len(program)]) + program
+    payload = decode_base58_checksum(address)
+    if len(payload) != 21:
+        raise ValueError('bad address length: {}'.format(len(payload)))
+    if payload[0] == (0x6f if testnet else 0x00):
+        # OP_DUP OP_HASH160 <20 byte hash> OP_EQUALVERIFY OP_CHECKSIG
+        return b'\x76\xa9\x14' + payload[1:] + b'\x88\xac'
+    if payload[0] == (0xc4 if testnet else 0x05):
+        # OP_HASH160 <20 byte hash> OP_EQUAL
+        return b'\xa9\x14' + payload[1:] + b'\x87'
+    raise ValueError('unknown address version: {}'.format(payload[0]))
+
+
+def address_to_script_pubkey_many(addresses, testnet=False):
+    '''address_to_script_pubkey for an iterable of addresses'''
+    return [address_to_script_pubkey(address, testnet) for address in addresses]
+
+
 def little_endian_to_int(b):
     '''little_endian_to_int takes byte sequence as a little-endian number.
     Returns an integer'''
@@ -76,7 +295,10 @@ def int_to_little_endian(n, length):
 
 def read_varint(s):
     '''read_varint reads a variable integer from a stream'''
-    i = s.read(1)[0]
+    first = s.read(1)
+    if not first:
+        raise EOFError('1 bytes wanted, 0 left')
+    i = first[0]
     if i == 0xfd:
         # 0xfd means the next two bytes are the number
         return little_endian_to_int(s.read(2))
@@ -91,6 +313,23 @@ def read_varint(s):
         return i
 
 
+def read_var_bytes(s):
+    '''reads a varint length and then that many bytes from a stream'''
+    n = read_varint(s)
+    data = s.read(n)
+    if len(data) != n:
+        raise EOFError('{} bytes wanted, {} left'.format(n, len(data)))
+    return data
+
+
+def read_struct(s, codec):
+    '''reads and unpacks the fields of a precompiled Struct from a stream'''
+    data = s.read(codec.size)
+    if len(data) != codec.size:
+        raise EOFError('{} bytes wanted, {} left'.format(codec.size, len(data)))
+    return codec.unpack(data)
+
+
 def encode_varint(i):
     '''encodes an integer as a varint'''
     if i < 0xfd:
@@ -105,6 +344,102 @@ def encode_varint(i):
         raise ValueError('integer too large: {}'.format(i))
 
 
+def varint_size(i):
+    '''number of bytes encode_varint(i) takes'''
+    if i < 0xfd:
+        return 1
+    elif i < 0x10000:
+        return 3
+    elif i < 0x100000000:
+        return 5
+    elif i < 0x10000000000000000:
+        return 9
+    else:
+        raise ValueError('integer too large: {}'.format(i))
+
+
+def write_varint(buffer, offset, i):
+    '''writes i as a varint into buffer at offset, returns the offset
+    right after it'''
+    if i < 0xfd:
+        buffer[offset] = i
+        return offset + 1
+    encoded = encode_varint(i)
+    buffer[offset:offset + len(encoded)] = encoded
+    return offset + len(encoded)
+
+
+# fixed layouts of transaction fields, all little endian
+# previous tx hash (as serialized, i.e. reversed) and output index
+OUTPOINT_STRUCT = Struct('<32sI')
+# the sequence closing an input
+SEQUENCE_STRUCT = Struct('<I')
+# the amount opening an output
+AMOUNT_STRUCT = Struct('<Q')
+# the version opening a tx, the locktime closing it
+VERSION_STRUCT = LOCKTIME_STRUCT = Struct('<I')
+
+
+class LRUCache:
+    '''a bounded, thread-safe mapping that evicts the least recently
+    used entry and counts hits, misses and evictions'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
 class HelperTest(TestCase):
 
     def test_little_endian_to_int(self):
@@ -130,3 +465,87 @@ class HelperTest(TestCase):
         self.assertEqual(h160, want)
         got = encode_base58_checksum(b'\x6f' + bytes.fromhex(h160))
         self.assertEqual(got, addr)
+
+    def test_base58_checksum(self):
+        for payload in (b'\x00\x00\x01\x02', b'\x6f' + bytes(range(20)), bytes(range(1, 79))):
+            self.assertEqual(decode_base58_checksum(encode_base58_checksum(payload)), payload)
+        with self.assertRaises(ValueError):
+            decode_base58_checksum('mnrVtF8DWjMu839VW3rBfgYaAfKk8983Xe')
+
+    def test_base58_many(self):
+        payloads = [b'', b'\x00', b'\x00\x00\xff', bytes(range(256)), b'\x00' + bytes(range(1, 200)) * 20]
+        for payload in payloads:
+            num, want = int.from_bytes(payload, 'big'), ''
+            while num > 0:
+                num, mod = divmod(num, 58)
+                want = BASE58_ALPHABET[mod] + want
+            want = '1' * (len(payload) - len(payload.lstrip(b'\x00'))) + want
+            self.assertEqual(encode_base58(payload), want)
+        encoded = encode_base58_many(payloads, checksum=False)
+        self.assertEqual(decode_base58_many(encoded, checksum=False), payloads)
+        self.assertEqual(decode_base58_many(encode_base58_many(payloads)), payloads)
+        with self.assertRaises(ValueError):
+            decode_base58_raw('1O')
+
+    def test_bech32(self):
+        vectors = (
+            ('BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4', False,
+             '0014751e76e8199196d454941c45d1b3a323f1433bd6'),
+            ('tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7', True,
+             '00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262'),
+            ('bc1pw508d6qejxtdg4y5r3zarvary0c5xw7kw508d6qejxtdg4y5r3zarvary0c5xw7kt5nd6y', False,
+             '5128751e76e8199196d454941c45d1b3a323f1433bd6751e76e8199196d454941c45d1b3a323f1433bd6'),
+            ('BC1SW50QGDZ25J', False, '6002751e'),
+        )
+        for address, testnet, script_pubkey in vectors:
+            self.assertEqual(address_to_script_pubkey(address, testnet).hex(), script_pubkey)
+            version, program = decode_segwit_address(address, testnet)
+            self.assertEqual(encode_segwit_address(version, program, testnet), address.lower())
+        for address in (
+                'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqh2y7hd',
+                'BC1QR508D6QEJXTDG4Y5R3ZARVARYV98GJ9P',
+                'bc1zw508d6qejxtdg4y5r3zarvaryvqyzf3du'):
+            with self.assertRaises(ValueError):
+                address_to_script_pubkey(address)
+        self.assertEqual(address_to_script_pubkey_many([
+            'mnrVtF8DWjMu839VW3rBfgYaAfKk8983Xf', '2N3u1R6uwQfuobCqbCgBkpsgBxvr1tZpe7B'], testnet=True), [
+            bytes.fromhex('76a914507b27411ccf7f16f10297de6cef3f291623eddf88ac'),
+            bytes.fromhex('a91474d691da1574e6b3c192ecfb52cc8984ee7b6c5687')])
+
+    def test_write_varint(self):
+        buffer = bytearray(20)
+        offset = 0
+        for i in (0, 0xfc, 0xfd, 0x10000, 0x100000000):
+            self.assertEqual(varint_size(i), len(encode_varint(i)))
+            end = write_varint(buffer, offset, i)
+            self.assertEqual(bytes(buffer[offset:end]), encode_varint(i))
+            offset = end
+        self.assertEqual(offset, 19)
+
+    def test_read_struct(self):
+        stream = BytesIO(bytes.fromhex('0100000002fd0301fe04030201ff0807060504030201') + bytes(31)
+                         + b'\xff\x02\x00\x00\x00\x02\xaa\xbb\xfd\x03\x00\x01\x02\x03\x05')
+        self.assertEqual(read_struct(stream, VERSION_STRUCT), (1,))
+        self.assertEqual([read_varint(stream) for _ in range(4)], [2, 0x103, 0x1020304, 0x102030405060708])
+        self.assertEqual(read_struct(stream, OUTPOINT_STRUCT), (bytes(31) + b'\xff', 2))
+        self.assertEqual(read_var_bytes(stream), b'\xaa\xbb')
+        self.assertEqual(read_var_bytes(stream), b'\x01\x02\x03')
+        with self.assertRaises(EOFError):
+            read_var_bytes(stream)
+        with self.assertRaises(EOFError):
+            read_varint(stream)
+        with self.assertRaises(EOFError):
+            read_struct(stream, SEQUENCE_STRUCT)
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        cache.resize(1)
+        self.assertEqual(list(cache._data), ['c'])
+        self.assertEqual(cache.stats(), {
+            'size': 1, 'maxsize': 1, 'hits': 1, 'misses': 1, 'evictions': 2})
@@ -0,0 +1,85 @@
+'''
+Walks a range of private keys secret, secret + stride, ... producing
+each public key with one point addition instead of a full secret * G,
+and normalizing the points in batches with a single inversion.
+'''
+from multiprocessing import Pool, cpu_count
+from unittest import TestCase
+
+from ecc import N, PrivateKey, sec_many
+from helper import encode_base58_checksum, hash160
+from secp256k1 import g_mul, jacobian_add_affine, jacobian_to_affine
+
+
+def walk_secs(start, count=None, stride=1, compressed=True, batch_size=256):
+    '''yields (secret, sec) for count secrets (endlessly when count is
+    None) starting at start and stepping by stride'''
+    step_x, step_y = jacobian_to_affine(g_mul(stride))
+    current = g_mul(start)
+    secret = start
+    remaining = count
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        points = []
+        for _ in range(size):
+            points.append(current)
+            current = jacobian_add_affine(current, step_x, step_y)
+        for sec in sec_many(points, compressed):
+            yield secret, sec
+            secret += stride
+        if remaining is not None:
+            remaining -= size
+
+
+def scan_range(start, count, stride=1, compressed=True, testnet=False, batch_size=256):
+    '''yields (secret, sec, hash160, address) for count secrets
+    starting at start and stepping by stride'''
+    if start < 1 or stride < 1 or start + stride * (count - 1) >= N:
+        raise ValueError('secrets must stay within 1 .. N - 1')
+    if testnet:
+        prefix = b'\x6f'
+    else:
+        prefix = b'\x00'
+    for secret, sec in walk_secs(start, count, stride, compressed, batch_size):
+        h160 = hash160(sec)
+        yield secret, sec, h160, encode_base58_checksum(prefix + h160)
+
+
+def _scan_chunk(args):
+    return list(scan_range(*args))
+
+
+def scan_range_parallel(start, count, stride=1, compressed=True, testnet=False, processes=None):
+    '''scan_range split into contiguous chunks over a process pool,
+    yielding the results in the same order'''
+    processes = processes or cpu_count()
+    chunk = max(1, -(-count // (processes * 4)))
+    jobs = []
+    for offset in range(0, count, chunk):
+        jobs.append((start + offset * stride, min(chunk, count - offset), stride, compressed, testnet))
+    if processes == 1 or len(jobs) == 1:
+        for job in jobs:
+            yield from scan_range(*job)
+        return
+    with Pool(processes) as pool:
+        for results in pool.imap(_scan_chunk, jobs):
+            yield from results
+
+
+class KeyRangeTest(TestCase):
+
+    def test_scan_range(self):
+        results = list(scan_range(0xfff0, 20, stride=3, testnet=True, batch_size=7))
+        self.assertEqual(len(results), 20)
+        for i, (secret, sec, h160, address) in enumerate(results):
+            self.assertEqual(secret, 0xfff0 + 3 * i)
+            point = PrivateKey(secret).point
+            self.assertEqual(sec, point.sec())
+            self.assertEqual(h160, point.hash160())
+            self.assertEqual(address, point.address(testnet=True))
+        with self.assertRaises(ValueError):
+            list(scan_range(N - 2, 3))
+
+    def test_scan_range_parallel(self):
+        want = list(scan_range(1, 50, compressed=False))
+        self.assertEqual(list(scan_range_parallel(1, 50, compressed=False, processes=2)), want)
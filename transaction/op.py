@@ -1,5 +1,8 @@
 import hashlib
 from logging import getLogger
+from os import urandom
+from random import randrange
+from threading import Lock
 
 from unittest import TestCase
 
@@ -675,6 +678,61 @@ def op_hash256(stack):
 # end::source2[]
 
 
+class SignatureCache:
+    '''remembers (z, sec, der) triples that verified, keyed by a salted
+    sha256 so entries cannot be predicted, evicting at random when full'''
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.salt = urandom(32)
+        self.hits = 0
+        self.misses = 0
+        self._positions = {}
+        self._keys = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def key(self, z, sec, der):
+        return hashlib.sha256(
+            self.salt + z.to_bytes(32, 'big') + bytes([len(sec)]) + sec + der).digest()
+
+    def contains(self, key):
+        if key in self._positions:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        with self._lock:
+            if key in self._positions:
+                return
+            while len(self._keys) >= self.max_entries > 0:
+                self._remove(randrange(len(self._keys)))
+            if self.max_entries > 0:
+                self._positions[key] = len(self._keys)
+                self._keys.append(key)
+
+    def clear(self):
+        with self._lock:
+            self._positions.clear()
+            self._keys.clear()
+            self.hits = self.misses = 0
+
+    def _remove(self, i):
+        # move the last key into the victim's slot so removal is O(1)
+        del self._positions[self._keys[i]]
+        last = self._keys.pop()
+        if i < len(self._keys):
+            self._keys[i] = last
+            self._positions[last] = i
+
+
+SIGNATURE_CACHE = SignatureCache()
+
+
 def op_checksig(stack, z):
     # check that there are at least 2 elements on the stack
     # the top element of the stack is the SEC pubkey
@@ -687,6 +745,11 @@ def op_checksig(stack, z):
         return False
     sec = stack.pop()
     sig = stack.pop()[:-1]
+    # a triple we have already verified does not need the curve work again
+    cache_key = SIGNATURE_CACHE.key(z, sec, sig)
+    if SIGNATURE_CACHE.contains(cache_key):
+        stack.append(encode_num(1))
+        return True
     try:
         pub_key_obj = S256Point.parse(sec)
         sig_obj = Signature.parse(sig)
@@ -694,6 +757,7 @@ def op_checksig(stack, z):
     except (ValueError, SyntaxError) as e:
         return False
     if pub_key_obj.verify(z, sig_obj):
+        SIGNATURE_CACHE.add(cache_key)
         stack.append(encode_num(1))
     else:
         stack.append(encode_num(0))
@@ -766,6 +830,29 @@ class OpTest(TestCase):
         self.assertTrue(op_checksig(stack, z))
         self.assertEqual(decode_num(stack[0]), 1)
 
+    def test_signature_cache(self):
+        z = 0x7c076ff316692a3d7eb3c3bb0f8b1488cf72e1afcd929e29307032997a838a3d
+        sec = bytes.fromhex(
+            '04887387e452b8eacc4acfde10d9aaf7f6d9a0f975aabb10d006e4da568744d06c61de6d95231cd89026e286df3b6ae4a894a3378e393e93a0f45b666329a0ae34')
+        sig = bytes.fromhex(
+            '3045022000eff69ef2b1bd93a66ed5219add4fb51e11a840f404876325a1e8ffe0529a2c022100c7207fee197d27c618aea621406f6bf5ef6fca38681d82b2f06fddbdce6feab601')
+        SIGNATURE_CACHE.clear()
+        for _ in range(2):
+            stack = [sig, sec]
+            self.assertTrue(op_checksig(stack, z))
+            self.assertEqual(decode_num(stack[0]), 1)
+        self.assertEqual((SIGNATURE_CACHE.hits, SIGNATURE_CACHE.misses), (1, 1))
+        stack = [sig, sec]
+        self.assertTrue(op_checksig(stack, z + 1))
+        self.assertEqual(decode_num(stack[0]), 0)
+        self.assertEqual(len(SIGNATURE_CACHE), 1)
+        cache = SignatureCache(max_entries=3)
+        for i in range(10):
+            cache.add(cache.key(i, sec, sig))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(sorted(cache._positions.values()), [0, 1, 2])
+        self.assertTrue(all(cache._keys[i] == k for k, i in cache._positions.items()))
+
 
 OP_CODE_FUNCTIONS = {
     0: op_0,
@@ -0,0 +1,147 @@
+'''
+BIP340 Schnorr signatures over x-only public keys, with a batch verifier
+that checks many signatures with one randomized multi-scalar
+multiplication.
+'''
+import hashlib
+from secrets import randbelow
+from unittest import TestCase
+
+from secp256k1 import (
+    B, GX, GY, N, P,
+    field_sqrt, g_mul, jacobian_to_affine, multi_mul, strauss_mul,
+)
+
+
+_TAG_HASHES = {}
+
+
+def tagged_hash(tag, msg):
+    '''sha256(sha256(tag) || sha256(tag) || msg)'''
+    prefix = _TAG_HASHES.get(tag)
+    if prefix is None:
+        tag_hash = hashlib.sha256(tag.encode()).digest()
+        prefix = _TAG_HASHES[tag] = tag_hash + tag_hash
+    return hashlib.sha256(prefix + msg).digest()
+
+
+def lift_x(x):
+    '''returns the curve point with x coordinate x and even y, None if
+    there is none'''
+    if x >= P:
+        return None
+    alpha = (x * x * x + B) % P
+    y = field_sqrt(alpha)
+    if y * y % P != alpha:
+        return None
+    return x, y if y % 2 == 0 else P - y
+
+
+def xonly_pubkey(secret):
+    '''returns the 32 byte x-only public key of secret'''
+    x, _ = jacobian_to_affine(g_mul(secret))
+    return x.to_bytes(32, 'big')
+
+
+def _challenge(r_bytes, pubkey, msg):
+    return int.from_bytes(tagged_hash('BIP0340/challenge', r_bytes + pubkey + msg), 'big') % N
+
+
+def schnorr_sign(secret, msg, aux_rand=b'\x00' * 32):
+    '''returns the 64 byte BIP340 signature of msg'''
+    if not 0 < secret < N:
+        raise ValueError('secret out of range')
+    x, y = jacobian_to_affine(g_mul(secret))
+    d = secret if y % 2 == 0 else N - secret
+    pubkey = x.to_bytes(32, 'big')
+    t = d ^ int.from_bytes(tagged_hash('BIP0340/aux', aux_rand), 'big')
+    k = int.from_bytes(tagged_hash('BIP0340/nonce', t.to_bytes(32, 'big') + pubkey + msg), 'big') % N
+    if k == 0:
+        raise ValueError('nonce is zero, try other aux_rand')
+    rx, ry = jacobian_to_affine(g_mul(k))
+    if ry % 2:
+        k = N - k
+    r_bytes = rx.to_bytes(32, 'big')
+    e = _challenge(r_bytes, pubkey, msg)
+    return r_bytes + ((k + e * d) % N).to_bytes(32, 'big')
+
+
+def schnorr_verify(pubkey, msg, sig):
+    '''checks a 64 byte BIP340 signature against a 32 byte x-only key'''
+    if len(pubkey) != 32 or len(sig) != 64:
+        return False
+    point = lift_x(int.from_bytes(pubkey, 'big'))
+    if point is None:
+        return False
+    r = int.from_bytes(sig[:32], 'big')
+    s = int.from_bytes(sig[32:], 'big')
+    if r >= P or s >= N:
+        return False
+    e = _challenge(sig[:32], pubkey, msg)
+    # R = s*G - e*P
+    total = jacobian_to_affine(strauss_mul((s, -e), ((GX, GY), point)))
+    return total is not None and total[1] % 2 == 0 and total[0] == r
+
+
+def schnorr_verify_batch(items):
+    '''checks (pubkey, msg, sig) triples all at once, returns True only if
+    every signature is valid. Each equation s*G = R + e*P is weighted by a
+    random a (the first by 1) and the sum is checked with one
+    multi-scalar multiplication:
+    (sum a*s)*G - sum a*R - sum (a*e)*P == infinity'''
+    coefficients = [0]
+    points = [(GX, GY)]
+    for i, (pubkey, msg, sig) in enumerate(items):
+        if len(pubkey) != 32 or len(sig) != 64:
+            return False
+        point = lift_x(int.from_bytes(pubkey, 'big'))
+        if point is None:
+            return False
+        r_point = lift_x(int.from_bytes(sig[:32], 'big'))
+        s = int.from_bytes(sig[32:], 'big')
+        if r_point is None or s >= N:
+            return False
+        a = 1 if i == 0 else randbelow(N - 1) + 1
+        e = _challenge(sig[:32], pubkey, msg)
+        coefficients[0] += a * s
+        coefficients += [N - a, -a * e % N]
+        points += [r_point, point]
+    return multi_mul(coefficients, points)[2] == 0
+
+
+class SchnorrTest(TestCase):
+
+    def test_bip340_vectors(self):
+        vectors = (
+            (3, '00' * 32, '00' * 32,
+             'f9308a019258c31049344f85f89d5229b531c845836f99b08601f113bce036f9',
+             'e907831f80848d1069a5371b402410364bdf1c5f8307b0084c55f1ce2dca8215'
+             '25f66a4a85ea8b71e482a74f382d2ce5ebeee8fdb2172f477df4900d310536c0'),
+            (0xb7e151628aed2a6abf7158809cf4f3c762e7160f38b4da56a784d9045190cfef,
+             '00' * 31 + '01',
+             '243f6a8885a308d313198a2e03707344a4093822299f31d0082efa98ec4e6c89',
+             'dff1d77f2a671c5f36183726db2341be58feae1da2deced843240f7b502ba659',
+             '6896bd60eeae296db48a229ff71dfe071bde413e6d43f917dc8dcf8c78de3341'
+             '8906d11ac976abccb20b091292bff4ea897efcb639ea871cfa95f6de339e4b0a'),
+        )
+        for secret, aux, msg, pubkey, sig in vectors:
+            pubkey, sig, msg = bytes.fromhex(pubkey), bytes.fromhex(sig), bytes.fromhex(msg)
+            self.assertEqual(xonly_pubkey(secret), pubkey)
+            self.assertEqual(schnorr_sign(secret, msg, bytes.fromhex(aux)), sig)
+            self.assertTrue(schnorr_verify(pubkey, msg, sig))
+            self.assertFalse(schnorr_verify(pubkey, msg[:-1] + bytes([msg[-1] ^ 1]), sig))
+
+    def test_verify_batch(self):
+        items = []
+        for i in range(1, 20):
+            secret = i * 0x1234567890abcdef
+            msg = i.to_bytes(32, 'big')
+            items.append((xonly_pubkey(secret), msg, schnorr_sign(secret, msg)))
+        self.assertTrue(schnorr_verify_batch(items))
+        # a zero padded key lifts to the same point but is not a BIP340 key
+        pubkey, msg, sig = items[3]
+        self.assertFalse(schnorr_verify(b'\x00' + pubkey, msg, sig))
+        self.assertFalse(schnorr_verify_batch(items[:3] + [(b'\x00' + pubkey, msg, sig)]))
+        pubkey, msg, sig = items[7]
+        items[7] = (pubkey, msg, sig[:-1] + bytes([sig[-1] ^ 1]))
+        self.assertFalse(schnorr_verify_batch(items))
@@ -1,7 +1,10 @@
 from hashlib import sha256
 from io import BytesIO
 
-from helper import read_varint, little_endian_to_int, int_to_little_endian, encode_varint
+from helper import (
+    little_endian_to_int, int_to_little_endian, encode_varint, read_var_bytes,
+    varint_size, write_varint,
+)
 from op import OP_CODE_FUNCTIONS, OP_CODE_NAMES, LOGGER, op_hash160, op_equal, op_verify
 
 
@@ -46,65 +49,110 @@ class Script:
 
     @classmethod
     def parse(cls, s):
-        len = read_varint(s)  # total bytes
+        '''parses a script from bytes or a stream'''
+        if not hasattr(s, 'read'):
+            s = BytesIO(s)
+        # one read for the whole script, the commands are sliced out of it
+        raw = read_var_bytes(s)
+        length = len(raw)  # total bytes
         cmds = []
         count = 0  # processed bytes
-        while count < len:
-            current = s.read(1)
+        while count < length:
+            current_byte = raw[count]
             count += 1
-            current_byte = current[0]
             # 0x01 ~ 0x75 is the length to be read
             if current_byte >= 1 and current_byte <= 75:
                 n = current_byte
-                cmds.append(s.read(n))
+                cmds.append(raw[count:count + n])
                 count += n
             elif current_byte == 76:
-                data_length = little_endian_to_int(s.read(1))
-                cmds.append(s.read(data_length))
+                if count >= length:
+                    raise SyntaxError('parsing script failed')
+                data_length = raw[count]
+                cmds.append(raw[count + 1:count + 1 + data_length])
                 count += data_length + 1
             elif current_byte == 77:
-                data_length = little_endian_to_int(s.read(2))
-                cmds.append(s.read(data_length))
+                data_length = little_endian_to_int(raw[count:count + 2])
+                cmds.append(raw[count + 2:count + 2 + data_length])
                 count += data_length + 2
             else:
                 op_code = current_byte
                 cmds.append(op_code)
-        if count != len:
+        if count != length:
             raise SyntaxError('parsing script failed')
         return Script(cmds)
 
-    def raw_serialize(self):
-        result = b''
+    def raw_serialized_size(self):
+        '''size of raw_serialize() without building it'''
+        size = 0
         for cmd in self.cmds:
             if type(cmd) == int:
-                result += int_to_little_endian(cmd, 1)
+                size += 1
             else:
                 length = len(cmd)
                 if length < 75:
-                    result += int_to_little_endian(length, 1)
+                    size += 1
+                elif length > 75 and length < 0x100:
+                    size += 2
+                elif length >= 0x100 and length <= 520:
+                    size += 3
+                else:
+                    raise ValueError('too long an cmd')
+                size += length
+        return size
+
+    def raw_serialize_into(self, buffer, offset=0):
+        '''writes raw_serialize() into buffer at offset, returns the
+        offset right after it'''
+        for cmd in self.cmds:
+            if type(cmd) == int:
+                buffer[offset] = cmd
+                offset += 1
+            else:
+                length = len(cmd)
+                if length < 75:
+                    buffer[offset] = length
+                    offset += 1
                 elif length > 75 and length < 0x100:
                     # OP_PUSHDATA1
-                    result += int_to_little_endian(76, 1)
-                    result += int_to_little_endian(length, 1)
+                    buffer[offset] = 76
+                    buffer[offset + 1] = length
+                    offset += 2
                 elif length >= 0x100 and length <= 520:
-                    result += int_to_little_endian(77, 1)
                     # OP_PUSHDATA2
-                    result += int_to_little_endian(length, 2)
+                    buffer[offset] = 77
+                    buffer[offset + 1:offset + 3] = int_to_little_endian(length, 2)
+                    offset += 3
                 else:
                     raise ValueError('too long an cmd')
-                result += cmd
-        return result
+                buffer[offset:offset + length] = cmd
+                offset += length
+        return offset
+
+    def raw_serialize(self):
+        result = bytearray(self.raw_serialized_size())
+        self.raw_serialize_into(result)
+        return bytes(result)
+
+    def serialized_size(self):
+        raw_size = self.raw_serialized_size()
+        return varint_size(raw_size) + raw_size
+
+    def serialize_into(self, buffer, offset=0):
+        '''writes serialize() into buffer, a bytearray or writable
+        memoryview, at offset and returns the offset right after it'''
+        offset = write_varint(buffer, offset, self.raw_serialized_size())
+        return self.raw_serialize_into(buffer, offset)
 
     def __add__(self, other):
         return Script(self.cmds + other.cmds)
 
     def serialize(self):
-        # get the raw serialization (no prepended length)
-        result = self.raw_serialize()
-        # get the length of the whole thing
-        total = len(result)
-        # encode_varint the total length of the result and prepend
-        return encode_varint(total) + result
+        # the length prefix and the raw serialization, in one buffer
+        raw_size = self.raw_serialized_size()
+        result = bytearray(varint_size(raw_size) + raw_size)
+        self.raw_serialize_into(result, write_varint(result, 0, raw_size))
+        return bytes(result)
 
     def evaluate(self, z, witness):
         # create a copy as we may need to add to this list if we have a
@@ -162,8 +210,7 @@ class Script:
                         return False
                     # hashes match! now add the RedeemScript
                     redeem_script = encode_varint(len(cmd)) + cmd
-                    stream = BytesIO(redeem_script)
-                    cmds.extend(Script.parse(stream).cmds)
+                    cmds.extend(Script.parse(redeem_script).cmds)
                 # witness program version 0 rule. if stack cmds are:
                 # 0 <20 byte hash> this is p2wpkh
                 # tag::source3[]
@@ -185,9 +232,8 @@ class Script:
                         print('bad sha256 {} vs {}'.format
                               (s256.hex(), sha256(witness_script).hex()))
                         return False
-                    stream = BytesIO(encode_varint(len(witness_script))
-                                     + witness_script)
-                    witness_script_cmds = Script.parse(stream).cmds  # <6>
+                    witness_script_cmds = Script.parse(
+                        encode_varint(len(witness_script)) + witness_script).cmds  # <6>
                     cmds.extend(witness_script_cmds)
                 # end::source6[]
         if len(stack) == 0:
@@ -196,11 +242,6 @@ class Script:
             return False
         return True
 
-    def serialize(self):
-        result = self.raw_serialize()
-        total = len(result)
-        return encode_varint(total) + result
-
 
 def p2pkh_script(h160):
     return Script([0x76, 0xa9, h160, 0x88, 0xac])
@@ -0,0 +1,437 @@
+'''
+Pure integer secp256k1 arithmetic. Field elements are ints mod P,
+affine points are (x, y) tuples and jacobian points (X, Y, Z) tuples,
+with None standing for the affine point at infinity. The S256Field and
+S256Point classes in ecc.py are thin wrappers over these functions.
+'''
+from unittest import TestCase
+
+
+P = 2 ** 256 - 2 ** 32 - 977
+A = 0
+B = 7
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+GX = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+GY = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+
+
+def field_inv(a):
+    # pow with a -1 exponent runs extended euclid, far cheaper than pow(a, P - 2, P)
+    return pow(a, -1, P)
+
+
+def field_sqrt(a):
+    '''returns a square root of a, valid only when a is a quadratic residue'''
+    return pow(a, (P + 1) // 4, P)
+
+
+def is_on_curve(x, y):
+    return (y * y - x * x * x - B) % P == 0
+
+
+def affine_add(p, q):
+    '''adds two affine points, either of which may be None (infinity)'''
+    if p is None:
+        return q
+    if q is None:
+        return p
+    x1, y1 = p
+    x2, y2 = q
+    if x1 == x2:
+        if (y1 + y2) % P == 0:
+            return None
+        s = 3 * x1 * x1 * field_inv(2 * y1) % P
+    else:
+        s = (y2 - y1) * field_inv(x2 - x1) % P
+    x3 = (s * s - x1 - x2) % P
+    return x3, (s * (x1 - x3) - y1) % P
+
+
+# Jacobian coordinates: (X, Y, Z) stands for the affine point (X/Z^2, Y/Z^3).
+# Additions and doublings need no field inversion, so a whole scalar
+# multiplication pays for exactly one inversion when converting back.
+JACOBIAN_INFINITY = (0, 1, 0)
+
+
+def jacobian_double(p):
+    '''doubles a jacobian point on y^2 = x^3 + 7 (dbl-2009-l)'''
+    x1, y1, z1 = p
+    if z1 == 0 or y1 == 0:
+        return JACOBIAN_INFINITY
+    a = x1 * x1 % P
+    b = y1 * y1 % P
+    c = b * b % P
+    d = 2 * ((x1 + b) * (x1 + b) - a - c) % P
+    e = 3 * a % P
+    x3 = (e * e - 2 * d) % P
+    y3 = (e * (d - x3) - 8 * c) % P
+    z3 = 2 * y1 * z1 % P
+    return x3, y3, z3
+
+
+def jacobian_add(p, q):
+    '''adds two jacobian points'''
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    if z1 == 0:
+        return q
+    if z2 == 0:
+        return p
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u1 == u2:
+        if s1 != s2:
+            return JACOBIAN_INFINITY
+        return jacobian_double(p)
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    y3 = (r * (v - x3) - s1 * hhh) % P
+    z3 = h * z1 * z2 % P
+    return x3, y3, z3
+
+
+def jacobian_add_affine(p, x2, y2):
+    '''adds the affine point (x2, y2) to a jacobian point (mixed addition)'''
+    x1, y1, z1 = p
+    if z1 == 0:
+        return x2, y2, 1
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    if x1 == u2:
+        if y1 != s2:
+            return JACOBIAN_INFINITY
+        return jacobian_double(p)
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    y3 = (r * (v - x3) - y1 * hhh) % P
+    z3 = h * z1 % P
+    return x3, y3, z3
+
+
+def jacobian_to_affine(p):
+    '''returns the affine (x, y) of a jacobian point, None for infinity'''
+    x, y, z = p
+    if z == 0:
+        return None
+    z_inv = field_inv(z)
+    z_inv2 = z_inv * z_inv % P
+    return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+
+def batch_inverse(values, modulus):
+    '''inverts all the values with a single modular inversion
+    (Montgomery's trick), zero values are left as zero'''
+    prefix = []
+    acc = 1
+    for value in values:
+        if value:
+            acc = acc * value % modulus
+        prefix.append(acc)
+    acc_inv = pow(acc, -1, modulus)
+    result = [0] * len(values)
+    for i in reversed(range(len(values))):
+        if values[i]:
+            previous = prefix[i - 1] if i else 1
+            result[i] = acc_inv * previous % modulus
+            acc_inv = acc_inv * values[i] % modulus
+    return result
+
+
+def batch_to_affine(points):
+    '''converts jacobian points to affine (x, y), None for infinity,
+    paying for a single field inversion'''
+    z_invs = batch_inverse([z for _, _, z in points], P)
+    result = []
+    for (x, y, z), z_inv in zip(points, z_invs):
+        if z == 0:
+            result.append(None)
+            continue
+        z_inv2 = z_inv * z_inv % P
+        result.append((x * z_inv2 % P, y * z_inv2 * z_inv % P))
+    return result
+
+
+def encode_sec(x, y, compressed=True):
+    '''returns the SEC encoding of the affine point (x, y)'''
+    if not compressed:
+        return b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+    if y % 2 == 0:
+        return b'\x02' + x.to_bytes(32, 'big')
+    else:
+        return b'\x03' + x.to_bytes(32, 'big')
+
+
+def jacobian_mul(x, y, coefficient):
+    '''computes coefficient * (x, y) with left-to-right double-and-add'''
+    result = JACOBIAN_INFINITY
+    for bit in bin(coefficient)[2:]:
+        result = jacobian_double(result)
+        if bit == '1':
+            result = jacobian_add_affine(result, x, y)
+    return result
+
+
+def build_fixed_base_table(x, y, window):
+    '''returns rows of affine multiples, row i holding j * 2^(window * i) * (x, y)
+    for j = 1 .. 2^window - 1, enough rows to cover 256 bit scalars'''
+    points = []
+    base = (x, y, 1)
+    for _ in range(0, 256, window):
+        current = base
+        for _ in range((1 << window) - 1):
+            points.append(current)
+            current = jacobian_add(current, base)
+        base = current
+    affine = batch_to_affine(points)
+    size = (1 << window) - 1
+    return [affine[i:i + size] for i in range(0, len(affine), size)]
+
+
+def fixed_base_mul(table, window, coefficient):
+    '''computes coefficient * point from its fixed-base table, additions only'''
+    result = JACOBIAN_INFINITY
+    mask = (1 << window) - 1
+    for row in table:
+        digit = coefficient & mask
+        if digit:
+            result = jacobian_add_affine(result, *row[digit - 1])
+        coefficient >>= window
+    return result
+
+
+G_WINDOW = 8
+_G_TABLE = None
+
+
+def g_table():
+    '''returns the fixed-base table for G, building it on first use'''
+    global _G_TABLE
+    if _G_TABLE is None:
+        _G_TABLE = build_fixed_base_table(GX, GY, G_WINDOW)
+    return _G_TABLE
+
+
+def g_mul(coefficient):
+    '''computes coefficient * G as a jacobian point'''
+    return fixed_base_mul(g_table(), G_WINDOW, coefficient % N)
+
+
+def wnaf(coefficient, width):
+    '''returns the width-w non-adjacent form of coefficient,
+    least significant digit first'''
+    digits = []
+    while coefficient:
+        if coefficient & 1:
+            digit = coefficient & ((1 << width) - 1)
+            if digit >= 1 << (width - 1):
+                digit -= 1 << width
+            coefficient -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        coefficient >>= 1
+    return digits
+
+
+def odd_multiples(x, y, width):
+    '''returns the affine points 1P, 3P, 5P ... (2^(width-1) - 1)P'''
+    point = (x, y, 1)
+    twice = jacobian_double(point)
+    multiples = [point]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(jacobian_add(multiples[-1], twice))
+    return batch_to_affine(multiples)
+
+
+WNAF_WIDTH = 5
+G_WNAF_WIDTH = 8
+_G_ODD_MULTIPLES = {}
+
+
+def g_odd_multiples(x, y):
+    '''returns the wide wNAF table when (x, y) is G or its endomorphism
+    image, building both on first use, None for any other point'''
+    if not _G_ODD_MULTIPLES:
+        _G_ODD_MULTIPLES.update({
+            (gx, GY): odd_multiples(gx, GY, G_WNAF_WIDTH)
+            for gx in (GX, BETA * GX % P)})
+    return _G_ODD_MULTIPLES.get((x, y))
+
+
+# secp256k1 has the endomorphism (x, y) -> (BETA * x, y), which equals
+# multiplying the point by LAMBDA. Splitting k = k1 + k2 * LAMBDA with
+# ~128 bit halves lets k * P run over half as many doublings.
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+GLV_B2 = GLV_A1
+
+
+def glv_split(coefficient):
+    '''returns k1, k2 with k1 + k2 * LAMBDA == coefficient (mod N),
+    both at most ~128 bits in absolute value'''
+    c1 = (GLV_B2 * coefficient + N // 2) // N
+    c2 = (-GLV_B1 * coefficient + N // 2) // N
+    k1 = coefficient - c1 * GLV_A1 - c2 * GLV_A2
+    k2 = -c1 * GLV_B1 - c2 * GLV_B2
+    return k1, k2
+
+
+def glv_terms(coefficient, x, y):
+    '''splits coefficient * (x, y) into two half-length (signed) terms
+    for strauss_mul'''
+    k1, k2 = glv_split(coefficient % N)
+    return [(k1, (x, y)), (k2, (BETA * x % P, y))]
+
+
+def glv_mul(x, y, coefficient):
+    '''computes coefficient * (x, y) through the GLV endomorphism'''
+    coefficients, points = zip(*glv_terms(coefficient, x, y))
+    return strauss_mul(coefficients, points)
+
+
+def strauss_mul(coefficients, points):
+    '''computes the sum of coefficient * point over affine (x, y) points
+    with interleaved wNAF, all terms sharing one chain of doublings.
+    A negative coefficient multiplies the negated point.'''
+    terms = []
+    for coefficient, (x, y) in zip(coefficients, points):
+        negate = coefficient < 0
+        coefficient = abs(coefficient) % N
+        if coefficient == 0:
+            continue
+        table = g_odd_multiples(x, y)
+        if table is not None:
+            width = G_WNAF_WIDTH
+        else:
+            width, table = WNAF_WIDTH, odd_multiples(x, y, WNAF_WIDTH)
+        digits = wnaf(coefficient, width)
+        if negate:
+            digits = [-digit for digit in digits]
+        terms.append((digits, table))
+    result = JACOBIAN_INFINITY
+    for i in reversed(range(max((len(digits) for digits, _ in terms), default=0))):
+        result = jacobian_double(result)
+        for digits, table in terms:
+            if i >= len(digits):
+                continue
+            digit = digits[i]
+            if digit > 0:
+                x, y = table[digit >> 1]
+                result = jacobian_add_affine(result, x, y)
+            elif digit < 0:
+                x, y = table[-digit >> 1]
+                result = jacobian_add_affine(result, x, P - y)
+    return result
+
+
+
+def pippenger_window(count):
+    '''bucket width in bits that roughly minimizes the additions for
+    count terms'''
+    return max(2, count.bit_length() - 4)
+
+
+def signed_digits(coefficient, window):
+    '''splits coefficient into base 2^window digits in
+    [-2^(window-1), 2^(window-1)], least significant first'''
+    digits = []
+    half = 1 << (window - 1)
+    mask = (1 << window) - 1
+    while coefficient:
+        digit = coefficient & mask
+        coefficient >>= window
+        if digit > half:
+            digit -= 1 << window
+            coefficient += 1
+        digits.append(digit)
+    return digits
+
+
+def pippenger_mul(coefficients, points, window=None):
+    '''computes the sum of coefficient * point over affine (x, y) points
+    with the bucket method: per window of bits every point is added once
+    into the bucket of its (signed) digit, and the buckets are summed with
+    a running sum, so the cost per term shrinks as the count grows'''
+    terms = []
+    for coefficient, point in zip(coefficients, points):
+        coefficient %= N
+        if coefficient and point is not None:
+            terms.append((coefficient, point))
+    if window is None:
+        window = pippenger_window(len(terms))
+    terms = [(signed_digits(coefficient, window), point) for coefficient, point in terms]
+    result = JACOBIAN_INFINITY
+    for i in reversed(range(max((len(digits) for digits, _ in terms), default=0))):
+        for _ in range(window):
+            result = jacobian_double(result)
+        buckets = [JACOBIAN_INFINITY] * (1 << (window - 1))
+        for digits, (x, y) in terms:
+            if i >= len(digits):
+                continue
+            digit = digits[i]
+            if digit > 0:
+                buckets[digit - 1] = jacobian_add_affine(buckets[digit - 1], x, y)
+            elif digit < 0:
+                buckets[-digit - 1] = jacobian_add_affine(buckets[-digit - 1], x, P - y)
+        # sum of digit * bucket[digit] = sum of the running sums from the top
+        running = window_sum = JACOBIAN_INFINITY
+        for bucket in reversed(buckets):
+            running = jacobian_add(running, bucket)
+            window_sum = jacobian_add(window_sum, running)
+        result = jacobian_add(result, window_sum)
+    return result
+
+
+# from about this many terms the bucket method beats interleaved wNAF
+PIPPENGER_THRESHOLD = 128
+
+
+def multi_mul(coefficients, points):
+    '''computes the sum of coefficient * point, picking Strauss for few
+    terms and Pippenger for many; None points (infinity) are skipped'''
+    terms = [(c, p) for c, p in zip(coefficients, points) if p is not None]
+    if not terms:
+        return JACOBIAN_INFINITY
+    coefficients, points = zip(*terms)
+    if len(terms) < PIPPENGER_THRESHOLD:
+        return strauss_mul(coefficients, points)
+    return pippenger_mul(coefficients, points)
+
+
+class Secp256k1Test(TestCase):
+
+    def test_affine_add(self):
+        g2 = affine_add((GX, GY), (GX, GY))
+        self.assertEqual(g2, jacobian_to_affine(jacobian_double((GX, GY, 1))))
+        g3 = affine_add(g2, (GX, GY))
+        self.assertEqual(g3, jacobian_to_affine(jacobian_mul(GX, GY, 3)))
+        self.assertTrue(is_on_curve(*g3))
+        self.assertIsNone(affine_add((GX, GY), (GX, P - GY)))
+
+    def test_field_sqrt(self):
+        y = field_sqrt((GX ** 3 + B) % P)
+        self.assertIn(y, (GY, P - GY))
+
+    def test_pippenger_mul(self):
+        points = [jacobian_to_affine(jacobian_mul(GX, GY, k)) for k in range(1, 20)]
+        coefficients = [(k * 0x9e3779b97f4a7c15) ** 3 for k in range(1, 20)]
+        want = jacobian_to_affine(strauss_mul(coefficients, points))
+        for window in (None, 1, 4, 7):
+            got = jacobian_to_affine(pippenger_mul(coefficients, points, window))
+            self.assertEqual(got, want)
@@ -1,10 +1,17 @@
 import json
+import os
 from io import BytesIO
+from tempfile import TemporaryFile
 from typing import List
+from unittest import TestCase
 from helper import SIGHASH_ALL
 import requests
 
-from helper import little_endian_to_int, read_varint, hash256, int_to_little_endian, encode_varint
+from helper import (
+    AMOUNT_STRUCT, LOCKTIME_STRUCT, OUTPOINT_STRUCT, SEQUENCE_STRUCT, VERSION_STRUCT,
+    little_endian_to_int, hash256, int_to_little_endian, encode_varint, read_struct, read_var_bytes,
+    read_varint, varint_size, write_varint,
+)
 from script import Script, p2pkh_script
 from ecc import S256Point, Signature
 
@@ -32,18 +39,39 @@ class TxIn:
 
     @classmethod
     def parse(cls, stream):
-        prev_tx = stream.read(32)[::-1]
-        prev_index = little_endian_to_int(stream.read(4))
+        if not hasattr(stream, 'read'):
+            stream = BytesIO(stream)
+        prev_tx, prev_index = read_struct(stream, OUTPOINT_STRUCT)
         script_sig = Script.parse(stream)
-        sequence = little_endian_to_int(stream.read(4))
-        return cls(prev_tx, prev_index, script_sig, sequence)
+        sequence, = read_struct(stream, SEQUENCE_STRUCT)
+        return cls(prev_tx[::-1], prev_index, script_sig, sequence)
+
+    def _check_prev_tx(self):
+        # the struct would silently pad or cut a hash of any other length
+        if len(self.prev_tx) != 32:
+            raise ValueError('prev_tx must be 32 bytes, not {}'.format(len(self.prev_tx)))
+
+    def outpoint(self):
+        '''the serialized previous tx hash and output index'''
+        self._check_prev_tx()
+        return OUTPOINT_STRUCT.pack(self.prev_tx[::-1], self.prev_index)
+
+    def serialized_size(self):
+        return 40 + self.script_sig.serialized_size()
+
+    def serialize_into(self, buffer, offset=0):
+        '''writes serialize() into buffer at offset, returns the offset
+        right after it'''
+        self._check_prev_tx()
+        OUTPOINT_STRUCT.pack_into(buffer, offset, self.prev_tx[::-1], self.prev_index)
+        offset = self.script_sig.serialize_into(buffer, offset + 36)
+        SEQUENCE_STRUCT.pack_into(buffer, offset, self.sequence)
+        return offset + 4
 
     def serialize(self):
-        result = self.prev_tx[::-1]
-        result += int_to_little_endian(self.prev_index, 4)
-        result += self.script_sig.serialize()
-        result += int_to_little_endian(self.sequence, 4)
-        return result
+        result = bytearray(self.serialized_size())
+        self.serialize_into(result)
+        return bytes(result)
 
     def __repr__(self):
         return '{}:{}:{}'.format(
@@ -60,17 +88,28 @@ class TxOut:
 
     @classmethod
     def parse(cls, stream):
-        amount = little_endian_to_int(stream.read(8))
+        if not hasattr(stream, 'read'):
+            stream = BytesIO(stream)
+        amount, = read_struct(stream, AMOUNT_STRUCT)
         script_pub_key = Script.parse(stream)
         return cls(amount, script_pub_key)
 
     def __repr__(self):
         return '{}:{}'.format(self.amount, self.script_pubkey)
 
+    def serialized_size(self):
+        return 8 + self.script_pubkey.serialized_size()
+
+    def serialize_into(self, buffer, offset=0):
+        '''writes serialize() into buffer at offset, returns the offset
+        right after it'''
+        AMOUNT_STRUCT.pack_into(buffer, offset, self.amount)
+        return self.script_pubkey.serialize_into(buffer, offset + 8)
+
     def serialize(self):
-        result = int_to_little_endian(self.amount, 8)
-        result += self.script_pubkey.serialize()
-        return result
+        result = bytearray(self.serialized_size())
+        self.serialize_into(result)
+        return bytes(result)
 
 
 # tag::source7[]
@@ -96,10 +135,10 @@ class TxFetcher:
                 raise ValueError('unexpected response: {}'.format(response.text))
             if raw[4] == 0:
                 raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
+                tx = Tx.parse(raw, testnet=testnet)
                 tx.locktime = little_endian_to_int(raw[-4:])
             else:
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
+                tx = Tx.parse(raw, testnet=testnet)
             if tx.id() != tx_id:  # <1>
                 raise ValueError('not the same id: {} vs {}'.format(tx.id(),
                                                                     tx_id))
@@ -116,10 +155,10 @@ class TxFetcher:
             raw = bytes.fromhex(raw_hex)
             if raw[4] == 0:
                 raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw))
+                tx = Tx.parse(raw)
                 tx.locktime = little_endian_to_int(raw[-4:])
             else:
-                tx = Tx.parse(BytesIO(raw))
+                tx = Tx.parse(raw)
             cls.cache[k] = tx
 
     @classmethod
@@ -146,20 +185,40 @@ class Tx:
 
     @classmethod
     def parse(cls, stream, testnet=False):
-        stream.read(4)
-        if stream.read(1) == b'\x00':
-            parse_method = cls.parse_segwit
-        else:
-            parse_method = cls.parse_legacy
-        stream.seek(-5, 1)
-        return parse_method(stream, testnet=testnet)
+        '''parses a transaction from bytes or a stream, which need not be
+        seekable'''
+        if not hasattr(stream, 'read'):
+            stream = BytesIO(stream)
+        version, = read_struct(stream, VERSION_STRUCT)
+        # the byte after the version is the segwit marker or the first
+        # byte of the number of inputs
+        first = stream.read(1)
+        if not first:
+            raise EOFError('1 bytes wanted, 0 left')
+        if first == b'\x00':
+            return cls._parse_segwit(stream, version, testnet)
+        tx_in_number = first[0]
+        if tx_in_number >= 0xfd:
+            size = 2 if tx_in_number == 0xfd else 4 if tx_in_number == 0xfe else 8
+            tx_in_number = little_endian_to_int(stream.read(size))
+        return cls._parse_legacy(stream, version, tx_in_number, testnet)
 
     @classmethod
     def parse_segwit(cls, stream, testnet=False):
-        version = little_endian_to_int(stream.read(4))
-        marker = stream.read(2)
-        if marker != b'\x00\x01':
-            raise RuntimeError('Not a segwit transaction {}'.format(marker))
+        if not hasattr(stream, 'read'):
+            stream = BytesIO(stream)
+        version, = read_struct(stream, VERSION_STRUCT)
+        marker = stream.read(1)
+        if marker != b'\x00':
+            raise RuntimeError('Not a segwit transaction {}'.format(marker + stream.read(1)))
+        return cls._parse_segwit(stream, version, testnet)
+
+    @classmethod
+    def _parse_segwit(cls, stream, version, testnet):
+        # what follows the version and the 0x00 marker
+        flag = stream.read(1)
+        if flag != b'\x01':
+            raise RuntimeError('Not a segwit transaction {}'.format(b'\x00' + flag))
         input_num = read_varint(stream)
         tx_ins = []
         for _ in range(input_num):
@@ -172,13 +231,13 @@ class Tx:
             num_items = read_varint(stream)
             items = []
             for _ in range(num_items):
-                item_len = read_varint(stream)
-                if item_len == 0:
+                item = read_var_bytes(stream)
+                if len(item) == 0:
                     items.append(0)
                 else:
-                    items.append(stream.read(item_len))
+                    items.append(item)
             tx_in.witness = items
-        locktime = little_endian_to_int(stream.read(4))
+        locktime, = read_struct(stream, LOCKTIME_STRUCT)
         return cls(version, tx_ins, tx_outs, locktime,
                    testnet=testnet, segwit=True)
 
@@ -188,7 +247,7 @@ class Tx:
         return inputs_sum - outputs_sum
 
     def sig_hash(self, input_index):
-        result = int_to_little_endian(self.version, 4)
+        result = VERSION_STRUCT.pack(self.version)
         result += encode_varint(len(self.tx_ins))
         for i, tx_in in enumerate(self.tx_ins):
             if i == input_index:
@@ -203,7 +262,7 @@ class Tx:
         result += encode_varint(len(self.tx_outs))
         for tx_out in self.tx_outs:
             result += tx_out.serialize()
-        result += int_to_little_endian(self.locktime, 4)
+        result += LOCKTIME_STRUCT.pack(self.locktime)
         result += int_to_little_endian(SIGHASH_ALL, 4)
         return int.from_bytes(hash256(result), 'big')
 
@@ -240,9 +299,14 @@ class Tx:
 
     @classmethod
     def parse_legacy(cls, stream, testnet=False):
-        serialized_version = stream.read(4)
-        version = little_endian_to_int(serialized_version)
-        tx_in_number = read_varint(stream)
+        if not hasattr(stream, 'read'):
+            stream = BytesIO(stream)
+        version, = read_struct(stream, VERSION_STRUCT)
+        return cls._parse_legacy(stream, version, read_varint(stream), testnet)
+
+    @classmethod
+    def _parse_legacy(cls, stream, version, tx_in_number, testnet):
+        # what follows the version and the number of inputs
         tx_ins = []
         for tx_in in range(tx_in_number):
             tx_ins.append(TxIn.parse(stream))
@@ -250,7 +314,7 @@ class Tx:
         tx_outs = []
         for tx_out in range(tx_out_number):
             tx_outs.append(TxOut.parse(stream))
-        locktime = little_endian_to_int(stream.read(4))
+        locktime, = read_struct(stream, LOCKTIME_STRUCT)
         print("parse tx: version: {}, locktime: {}".format(version, locktime))
         for tx_in in tx_ins:
             print(f"tx_in: {tx_in}\n")
@@ -265,34 +329,67 @@ class Tx:
             return self.serialize_legacy()
 
     def serialize_legacy(self):
-        result = int_to_little_endian(self.version, 4)
-        result += encode_varint(len(self.tx_ins))
-        for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
-        for tx_out in self.tx_outs:
-            result += tx_out.serialize()
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+        result = bytearray(self.serialized_size(segwit=False))
+        self.serialize_into(result, segwit=False)
+        return bytes(result)
 
     def serialize_segwit(self):
-        result = int_to_little_endian(self.version, 4)
-        result += b'\x00\x01'
-        result += encode_varint(len(self.tx_ins))
+        result = bytearray(self.serialized_size(segwit=True))
+        self.serialize_into(result, segwit=True)
+        return bytes(result)
+
+    def serialized_size(self, segwit=None):
+        '''size of the serialization, segwit or legacy as self.segwit
+        unless segwit is given'''
+        if segwit is None:
+            segwit = self.segwit
+        size = 8 + varint_size(len(self.tx_ins)) + varint_size(len(self.tx_outs))
         for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
+            size += tx_in.serialized_size()
         for tx_out in self.tx_outs:
-            result += tx_out.serialize()
+            size += tx_out.serialized_size()
+        if segwit:
+            # marker, flag and one witness item count per input
+            size += 2 + len(self.tx_ins)
+            for tx_in in self.tx_ins:
+                for item in tx_in.witness:
+                    if type(item) == int:
+                        size += 1
+                    else:
+                        size += varint_size(len(item)) + len(item)
+        return size
+
+    def serialize_into(self, buffer, offset=0, segwit=None):
+        '''writes the serialization into buffer, a bytearray or writable
+        memoryview of at least serialized_size() bytes, at offset and
+        returns the offset right after it'''
+        if segwit is None:
+            segwit = self.segwit
+        VERSION_STRUCT.pack_into(buffer, offset, self.version)
+        offset += 4
+        if segwit:
+            buffer[offset:offset + 2] = b'\x00\x01'
+            offset += 2
+        offset = write_varint(buffer, offset, len(self.tx_ins))
         for tx_in in self.tx_ins:
-            result += int_to_little_endian(len(tx_in.witness), 1)
-            for item in tx_in.witness:
-                if type(item) == int:
-                    result += int_to_little_endian(item, 1)
-                else:
-                    result += encode_varint(len(item)) + item
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+            offset = tx_in.serialize_into(buffer, offset)
+        offset = write_varint(buffer, offset, len(self.tx_outs))
+        for tx_out in self.tx_outs:
+            offset = tx_out.serialize_into(buffer, offset)
+        if segwit:
+            for tx_in in self.tx_ins:
+                buffer[offset:offset + 1] = int_to_little_endian(len(tx_in.witness), 1)
+                offset += 1
+                for item in tx_in.witness:
+                    if type(item) == int:
+                        buffer[offset:offset + 1] = int_to_little_endian(item, 1)
+                        offset += 1
+                    else:
+                        offset = write_varint(buffer, offset, len(item))
+                        buffer[offset:offset + len(item)] = item
+                        offset += len(item)
+        LOCKTIME_STRUCT.pack_into(buffer, offset, self.locktime)
+        return offset + 4
 
     def __repr__(self):
         tx_ins = ''
@@ -320,8 +417,8 @@ class Tx:
             all_prevouts = b''
             all_sequence = b''
             for tx_in in self.tx_ins:
-                all_prevouts += tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
-                all_sequence += int_to_little_endian(tx_in.sequence, 4)
+                all_prevouts += tx_in.outpoint()
+                all_sequence += SEQUENCE_STRUCT.pack(tx_in.sequence)
             self._hash_prevouts = hash256(all_prevouts)
             self._hash_sequence = hash256(all_sequence)
         return self._hash_prevouts
@@ -344,9 +441,9 @@ class Tx:
         signed for index input_index'''
         tx_in = self.tx_ins[input_index]
         # per BIP143 spec
-        s = int_to_little_endian(self.version, 4)
+        s = VERSION_STRUCT.pack(self.version)
         s += self.hash_prevouts() + self.hash_sequence()
-        s += tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+        s += tx_in.outpoint()
         if witness_script:
             script_code = witness_script.serialize()
         elif redeem_script:
@@ -354,9 +451,76 @@ class Tx:
         else:
             script_code = p2pkh_script(tx_in.script_pubkey(self.testnet).cmds[1]).serialize()
         s += script_code
-        s += int_to_little_endian(tx_in.value(), 8)
-        s += int_to_little_endian(tx_in.sequence, 4)
+        s += AMOUNT_STRUCT.pack(tx_in.value())
+        s += SEQUENCE_STRUCT.pack(tx_in.sequence)
         s += self.hash_outputs()
-        s += int_to_little_endian(self.locktime, 4)
+        s += LOCKTIME_STRUCT.pack(self.locktime)
         s += int_to_little_endian(SIGHASH_ALL, 4)
         return int.from_bytes(hash256(s), 'big')
+
+
+class TxTest(TestCase):
+    # a legacy p2pkh spend and the signed BIP143 native p2wpkh example
+    legacy_hex = (
+        '0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff'
+        '192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f678'
+        '01c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff'
+        '02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762'
+        'dd5423e332166702cb75f40df79fea1288ac19430600')
+    segwit_hex = (
+        '01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000049483045022100'
+        '8b9d1dc26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c04'
+        '89bc22ede944ccf4ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b9'
+        '0ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac909351'
+        '0d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac000247304402203609e17b84f6a7d30c80bfa6'
+        '10b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02d'
+        'e67eebee0121025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee635711000000')
+
+    def check_round_trip(self, tx, raw):
+        self.assertEqual(tx.serialize(), raw)
+        self.assertEqual(tx.serialized_size(), len(raw))
+        buffer = bytearray(len(raw) + 10)
+        self.assertEqual(tx.serialize_into(memoryview(buffer), 3), 3 + len(raw))
+        self.assertEqual(bytes(buffer[3:3 + len(raw)]), raw)
+        self.assertEqual(bytes(buffer[:3] + buffer[3 + len(raw):]), bytes(10))
+
+    def test_round_trip(self):
+        for raw, segwit in ((bytes.fromhex(self.legacy_hex), False), (bytes.fromhex(self.segwit_hex), True)):
+            tx = Tx.parse(raw)
+            self.assertEqual(tx.segwit, segwit)
+            self.check_round_trip(tx, raw)
+            for tx_in in tx.tx_ins:
+                self.assertEqual(tx_in.serialized_size(), len(tx_in.serialize()))
+            for tx_out in tx.tx_outs:
+                self.assertEqual(tx_out.serialized_size(), len(tx_out.serialize()))
+            # a stream is left right after the transaction
+            stream = BytesIO(b'\xaa' + raw + b'\xbb')
+            stream.read(1)
+            self.check_round_trip(Tx.parse(stream), raw)
+            self.assertEqual(stream.read(), b'\xbb')
+            with TemporaryFile() as f:
+                f.write(raw + raw + b'\xbb')
+                f.seek(0)
+                for _ in range(2):
+                    self.check_round_trip(Tx.parse(f), raw)
+                self.assertEqual(f.read(), b'\xbb')
+            # a pipe cannot seek
+            read_end, write_end = os.pipe()
+            os.write(write_end, raw + b'\xbb')
+            os.close(write_end)
+            with os.fdopen(read_end, 'rb') as f:
+                self.check_round_trip(Tx.parse(f), raw)
+                self.assertEqual(f.read(), b'\xbb')
+
+    def test_truncated(self):
+        raw = bytes.fromhex(self.legacy_hex)
+        with self.assertRaises(EOFError):
+            Tx.parse(raw[:-1])
+        with self.assertRaises(SyntaxError):
+            Script.parse(b'\x01\x4c')
+
+    def test_prev_tx_length(self):
+        with self.assertRaises(ValueError):
+            TxIn(bytes(31), 0).serialize()
+        with self.assertRaises(ValueError):
+            TxIn(bytes(33), 0).outpoint()
@@ -0,0 +1,204 @@
+'''
+Searches for private keys whose p2pkh address or hash160 starts with a
+given prefix. Keys are walked with point additions (keyrange.walk_secs)
+and candidates are filtered on the hash160 itself: an address prefix is
+turned into the hash160 intervals that can produce it, so base58 is only
+computed for the few keys that fall inside one.
+'''
+from multiprocessing import Event, Process, Queue, Value, cpu_count
+from queue import Empty
+from secrets import randbelow
+from time import perf_counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from ecc import N, PrivateKey
+from helper import BASE58_ALPHABET, encode_base58_checksum, hash160
+from keyrange import walk_secs
+
+
+def address_prefix_ranges(prefix, testnet=False):
+    '''returns inclusive (low, high) hash160 intervals, as integers, that
+    contain every hash160 whose p2pkh address starts with prefix, or None
+    when the prefix has to be checked on the base58 string'''
+    if testnet:
+        version = 0x6f
+        lowest, highest = 0x6f << 192, (0x70 << 192) - 1
+        digits = prefix
+    else:
+        # the 0x00 version byte is the leading '1', a second '1' would
+        # mean the hash160 itself starts with a zero byte
+        if not prefix.startswith('1') or prefix[1:2] == '1':
+            return None
+        version = 0
+        lowest, highest = 1 << 184, (1 << 192) - 1
+        digits = prefix[1:]
+    value = 0
+    for c in digits:
+        value = value * 58 + BASE58_ALPHABET.index(c)
+    ranges = []
+    for length in range(len(digits), 36):
+        scale = 58 ** (length - len(digits))
+        low = max(value * scale, lowest)
+        high = min((value + 1) * scale - 1, highest)
+        if low <= high:
+            # the last 4 bytes are the checksum
+            ranges.append(((low - (version << 192)) >> 32, (high - (version << 192)) >> 32))
+    return ranges
+
+
+def make_matcher(prefix, kind='address', testnet=False):
+    '''returns a function of (h160) telling whether the key can match,
+    and a function of (h160) confirming the match'''
+    if testnet:
+        version = b'\x6f'
+    else:
+        version = b'\x00'
+    if kind == 'hash160':
+        # whole bytes are compared directly, an odd last digit against
+        # the high nibble of the next byte
+        if len(prefix) > 40:
+            raise ValueError('a hash160 has 40 hex digits: {}'.format(prefix))
+        wanted = bytes.fromhex(prefix[:len(prefix) & ~1])
+        if len(prefix) % 2 == 0:
+            return lambda h160: h160.startswith(wanted), lambda h160: True
+        nibble, index = int(prefix[-1], 16), len(wanted)
+        return lambda h160: h160.startswith(wanted) and h160[index] >> 4 == nibble, lambda h160: True
+    if kind != 'address':
+        raise ValueError('unknown kind: {}'.format(kind))
+    if any(c not in BASE58_ALPHABET for c in prefix):
+        raise ValueError('not a base58 prefix: {}'.format(prefix))
+    if prefix[:1] not in (('m', 'n') if testnet else ('1',)):
+        raise ValueError('no p2pkh address starts with {}'.format(prefix))
+
+    def confirm(h160):
+        return encode_base58_checksum(version + h160).startswith(prefix)
+
+    ranges = address_prefix_ranges(prefix, testnet)
+    if ranges is None:
+        return lambda h160: True, confirm
+    if not ranges:
+        raise ValueError('no p2pkh address starts with {}'.format(prefix))
+
+    def candidate(h160):
+        value = int.from_bytes(h160, 'big')
+        for low, high in ranges:
+            if low <= value <= high:
+                return True
+        return False
+
+    return candidate, confirm
+
+
+def _search_worker(prefix, kind, compressed, testnet, batch_size, counter, found, results, start):
+    candidate, confirm = make_matcher(prefix, kind, testnet)
+    checked = 0
+    for secret, sec in walk_secs(start, compressed=compressed, batch_size=batch_size):
+        h160 = hash160(sec)
+        checked += 1
+        if candidate(h160) and confirm(h160):
+            with counter.get_lock():
+                counter.value += checked
+            results.put(secret)
+            found.set()
+            return
+        if checked == batch_size:
+            with counter.get_lock():
+                counter.value += checked
+            checked = 0
+            if found.is_set():
+                return
+
+
+def search(prefix, kind='address', compressed=True, testnet=False, processes=None,
+           batch_size=1024, progress=None, progress_interval=1.0):
+    '''returns a PrivateKey whose address (kind='address') or hex hash160
+    (kind='hash160') starts with prefix, searching on every core.
+    progress, if given, is called with a dict of keys checked, elapsed
+    seconds and keys per second every progress_interval seconds'''
+    make_matcher(prefix, kind, testnet)
+    processes = processes or cpu_count()
+    counter = Value('Q', 0)
+    found = Event()
+    results = Queue()
+    workers = []
+    for _ in range(processes):
+        # random, far apart starting points so workers never overlap
+        start = randbelow(N - 2 ** 64) + 1
+        workers.append(Process(target=_search_worker, daemon=True, args=(
+            prefix, kind, compressed, testnet, batch_size, counter, found, results, start)))
+    started = perf_counter()
+    for worker in workers:
+        worker.start()
+    try:
+        while True:
+            try:
+                secret = results.get(timeout=progress_interval)
+                break
+            except Empty:
+                if progress is not None:
+                    progress(search_stats(counter.value, started))
+                if any(worker.is_alive() for worker in workers):
+                    continue
+                # a worker that found a key may have exited right after
+                # putting it on the queue
+                try:
+                    secret = results.get(timeout=progress_interval)
+                    break
+                except Empty:
+                    raise RuntimeError('every search worker exited, exit codes {}'.format(
+                        [worker.exitcode for worker in workers]))
+    finally:
+        found.set()
+        for worker in workers:
+            worker.join()
+    if progress is not None:
+        progress(search_stats(counter.value, started))
+    return PrivateKey(secret)
+
+
+def search_stats(keys, started):
+    elapsed = perf_counter() - started
+    return {
+        'keys': keys,
+        'elapsed': elapsed,
+        'keys_per_second': keys / elapsed if elapsed else 0.0,
+    }
+
+
+class VanityTest(TestCase):
+
+    def test_address_prefix_ranges(self):
+        for secret in range(1, 40):
+            point = PrivateKey(secret).point
+            for testnet in (False, True):
+                address = point.address(testnet=testnet)
+                value = int.from_bytes(point.hash160(), 'big')
+                for size in (2, 3, 4):
+                    ranges = address_prefix_ranges(address[:size], testnet)
+                    if ranges is None:
+                        continue
+                    self.assertTrue(any(low <= value <= high for low, high in ranges))
+        self.assertIsNone(address_prefix_ranges('11'))
+
+    def test_search(self):
+        private_key = search('1A', processes=1, batch_size=64)
+        self.assertTrue(private_key.point.address().startswith('1A'))
+        private_key = search('ab', kind='hash160', testnet=True, processes=2, batch_size=64)
+        self.assertTrue(private_key.point.hash160().hex().startswith('ab'))
+        candidate, _ = make_matcher('abc', kind='hash160')
+        self.assertTrue(candidate(bytes.fromhex('abcd') + bytes(18)))
+        self.assertFalse(candidate(bytes.fromhex('abdc') + bytes(18)))
+        self.assertTrue(make_matcher('A', kind='hash160')[0](bytes.fromhex('a0') + bytes(19)))
+        with self.assertRaises(ValueError):
+            search('1O')
+        with self.assertRaises(ValueError):
+            search('3A')
+        with self.assertRaises(ValueError):
+            search('1' + 'z' * 34)
+
+    def test_search_workers_exit(self):
+        # forked workers inherit the patch and die on their first key
+        with patch('vanity.walk_secs', side_effect=SystemExit(3)), \
+                self.assertRaises(RuntimeError):
+            search('1A', processes=2, progress_interval=0.1)